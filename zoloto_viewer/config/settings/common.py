@@ -48,6 +48,7 @@ MIDDLEWARE = [
 
 MIDDLEWARE_DEV = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'zoloto_viewer.helpers.db_stats.QueryStatsMiddleware',
 ]
 
 ROOT_URLCONF = 'zoloto_viewer.config.urls'
@@ -118,9 +119,38 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
 
+# requests making more sql queries are logged with a warning, see helpers.db_stats (dev middleware)
+REQUEST_QUERIES_WARN_COUNT = int(os.getenv('REQUEST_QUERIES_WARN_COUNT', 200))
+
 # background_task app settings
 MAX_RUN_TIME = 3600
 
+# documents app settings
+# processes computing per-floor pdf layout, 1 means serial generation
+PDF_LAYOUT_WORKERS = int(os.getenv('PDF_LAYOUT_WORKERS', 1))
+# plans are resampled to that resolution within the plan area before embedding into pdf
+PDF_PLAN_DPI = int(os.getenv('PDF_PLAN_DPI', 150))
+PDF_PLAN_JPEG_QUALITY = int(os.getenv('PDF_PLAN_JPEG_QUALITY', 60))
+# seconds to keep computed floor layouts in redis, 0 disables the cache
+PDF_LAYOUT_CACHE_TTL = int(os.getenv('PDF_LAYOUT_CACHE_TTL', 7 * 24 * 60 * 60))
+# seconds per floor to improve caption placement after the greedy pass, keeps generation under MAX_RUN_TIME
+# for projects of up to ~100 floors; 0 gives the greedy draft only, negative means no limit
+PDF_CAPTION_TIME_BUDGET = float(os.getenv('PDF_CAPTION_TIME_BUDGET', 30))
+# infoplan boxes layout on message pages: 'rows' or 'skyline' (denser, see pdf_generation.message)
+PDF_MESSAGES_PACKING = os.getenv('PDF_MESSAGES_PACKING', 'rows')
+# generated pdf is kept in memory up to that size (bytes), bigger ones are spooled to a temp file
+PDF_SPOOL_MAX_SIZE = int(os.getenv('PDF_SPOOL_MAX_SIZE', 32 * 1024 * 1024))
+# csv project files are kept in memory up to that size (bytes) before upload, bigger ones are spooled to a temp file
+CSV_SPOOL_MAX_SIZE = int(os.getenv('CSV_SPOOL_MAX_SIZE', 8 * 1024 * 1024))
+# threads downloading or regenerating layer files of the infoplan archive, 1 means serial
+INFOPLAN_ARCHIVE_WORKERS = int(os.getenv('INFOPLAN_ARCHIVE_WORKERS', 4))
+# 1 to build infoplan.tar.gz instead of plain tar
+INFOPLAN_ARCHIVE_GZIP = bool(int(os.getenv('INFOPLAN_ARCHIVE_GZIP', 0)))
+# infoplan archive is kept in memory up to that size (bytes), bigger ones are spooled to a temp file
+INFOPLAN_ARCHIVE_SPOOL_MAX_SIZE = int(os.getenv('INFOPLAN_ARCHIVE_SPOOL_MAX_SIZE', 32 * 1024 * 1024))
+# project files taking longer (seconds) are logged with a warning, see documents.utils.generation_report
+GENERATION_REPORT_WARN_TIME = float(os.getenv('GENERATION_REPORT_WARN_TIME', MAX_RUN_TIME / 2))
+
 
 def heroku_database_url_adapter(url: str):
     """
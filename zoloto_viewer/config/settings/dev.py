@@ -88,6 +88,14 @@ LOGGING = {
         'zoloto_viewer.documents.pdf_generation.plan': {
             'handlers': ['console'],
             'level': 'DEBUG',
-        }
+        },
+        'zoloto_viewer.documents.utils.generation_report': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'zoloto_viewer.helpers.db_stats': {
+            'handlers': ['console'],
+            'level': 'DEBUG',
+        },
     }
 }
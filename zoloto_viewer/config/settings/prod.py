@@ -78,6 +78,10 @@ LOGGING = {
         'zoloto_viewer.documents.pdf_generation.plan': {
             'handlers': ['console'],
             'level': 'DEBUG',
-        }
+        },
+        'zoloto_viewer.documents.utils.generation_report': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
     }
 }
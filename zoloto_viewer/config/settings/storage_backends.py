@@ -1,4 +1,5 @@
 import boto3
+import functools
 import io
 from django.conf import settings
 from storages.backends.s3boto3 import S3Boto3Storage   # noqa
@@ -13,9 +14,15 @@ class S3StaticStorage(S3Boto3Storage):
     location = settings.AWS_LOCATION
 
 
+@functools.lru_cache(maxsize=None)
+def s3_client():
+    """One client per process: clients are thread-safe, but slow to create and creating them is not thread-safe"""
+    return boto3.client('s3')
+
+
 def s3_download_bytes(name):
     buf = io.BytesIO()
-    s3 = boto3.client('s3')
+    s3 = s3_client()
     bucket_name = settings.AWS_STORAGE_BUCKET_NAME
     bucket_location = S3MediaStorage.location
     s3.download_fileobj(bucket_name, f'{bucket_location}/{name}', buf)
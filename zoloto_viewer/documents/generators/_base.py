@@ -1,9 +1,19 @@
 import abc
 import csv
 import io
+from typing import BinaryIO, Iterator
+
+# approximate size of encoded csv chunks, in characters
+CSV_CHUNK_SIZE = 64 * 1024
 
 
 class AbstractCsvFileBuilder(abc.ABC):
+    """
+    make_rows may return a generator, rows are consumed lazily in streaming mode:
+    iter_encoded / write_to / open_stream keep only one chunk of csv in memory.
+    build() collects the whole csv in self.buffer
+    """
+
     def __init__(self):
         self.csv_header = ()
         self.buffer = io.StringIO()
@@ -13,11 +23,48 @@ class AbstractCsvFileBuilder(abc.ABC):
     def make_rows(self):
         pass
 
-    @property
-    def buffer_bytes(self):
-        return io.BytesIO(self.buffer.getvalue().encode('utf-8'))
-
     def build(self):
         writer = csv.writer(self.buffer, dialect='excel', delimiter=',')
         writer.writerow(self.csv_header)
         writer.writerows(self.make_rows())
+
+    def iter_encoded(self, chunk_size=CSV_CHUNK_SIZE) -> Iterator[bytes]:
+        chunk = io.StringIO()
+        writer = csv.writer(chunk, dialect='excel', delimiter=',')
+        writer.writerow(self.csv_header)
+        for row in self.make_rows():
+            writer.writerow(row)
+            if chunk.tell() >= chunk_size:
+                yield chunk.getvalue().encode('utf-8')
+                chunk.seek(0)
+                chunk.truncate()
+        if chunk.tell():
+            yield chunk.getvalue().encode('utf-8')
+
+    def write_to(self, fileobj: BinaryIO):
+        for data in self.iter_encoded():
+            fileobj.write(data)
+
+    def open_stream(self) -> BinaryIO:
+        """Readable binary file object, e.g. for FileResponse"""
+        return io.BufferedReader(_IteratorReader(self.iter_encoded()), buffer_size=CSV_CHUNK_SIZE)
+
+
+class _IteratorReader(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
@@ -1,18 +1,20 @@
-from collections import defaultdict
+import functools
+import operator
+
+from django.db.models import Count, Q
 from typing import Dict
 
-from zoloto_viewer.infoplan.models import (
-    Marker,
-    MarkerVariable,
-    MarkerFingerpost,
-)
+from zoloto_viewer.infoplan.models import MarkerVariable
 from zoloto_viewer.viewer.models import (
     Project,
     Layer,
+    MarkerKind,
 )
 
 from . import _base
 
+FINGERPOST_SIDES = range(1, 9)
+
 
 class CountFileBuilder(_base.AbstractCsvFileBuilder):
     def __init__(self, project: 'Project'):
@@ -21,30 +23,33 @@ class CountFileBuilder(_base.AbstractCsvFileBuilder):
         self.project = project
 
     def make_rows(self):
+        layers = Layer.objects.filter(project=self.project).select_related('kind') \
+            .annotate(markers_count=Count('marker')).order_by('number')
+        panes_count = _fingerpost_panes_count(self.project)
         return (
-            (L.title, L.desc, _report_count(L, markers))
-            for L, markers in Marker.objects.by_layer(self.project).items()
+            (L.title, L.desc, _report_count(L, panes_count.get(L.id, 0)))
+            for L in layers
         )
 
 
-def _report_count(layer: Layer, markers) -> str:
+def _fingerpost_panes_count(project: 'Project') -> Dict[int, int]:
+    """Число заполненных переменных на включённых лопастях фингерпостов, по слоям"""
+    side_enabled = functools.reduce(operator.or_, (
+        Q(side=n, **{f'marker__markerfingerpost__side{n}_enabled': True})
+        for n in FINGERPOST_SIDES
+    ))
+    return dict(
+        MarkerVariable.objects
+            .filter(marker__layer__project=project, marker__layer__kind__name=MarkerKind.FINGERPOST)
+            .exclude(value='')
+            .filter(side_enabled)
+            .values_list('marker__layer_id')
+            .annotate(panes_count=Count('id'))
+            .order_by()
+    )
+
+
+def _report_count(layer: Layer, panes_count: int) -> str:
     if layer.kind.is_fingerpost:
-        markers_count = markers.count()
-
-        marker_panes_count = defaultdict(int)
-        marker_panes_data: Dict[str, MarkerFingerpost] = {
-            mf.marker_id: mf
-            for mf in MarkerFingerpost.objects.filter(marker__in=markers)
-        }
-        for marker_uid, side, value in (
-            MarkerVariable.objects
-                .filter(marker__in=markers)
-                .values_list('marker_id', 'side', 'value')
-        ):
-            if value and marker_panes_data[marker_uid].is_enabled(side):
-                marker_panes_count[marker_uid] += 1
-        panes_count = sum(marker_panes_count.values())
-
-        return f'{markers_count}Ш + {panes_count}Л'
-
-    return str(markers.count())
+        return f'{layer.markers_count}Ш + {panes_count}Л'
+    return str(layer.markers_count)
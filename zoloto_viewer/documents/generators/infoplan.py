@@ -1,9 +1,13 @@
 import collections
 import itertools
 import html
+import operator
 from typing import (
+    Dict,
+    Iterable,
     List,
     Generator,
+    Tuple,
 )
 
 from zoloto_viewer.infoplan.models import Marker, MarkerVariable
@@ -12,6 +16,10 @@ from zoloto_viewer.viewer.models import Layer
 
 from . import _base
 
+FINGERPOST_SIDES = range(1, 9)
+# markers are read by server-side cursor in chunks of rows, each row is one variable of marker
+ROWS_CHUNK_SIZE = 2000
+
 
 class InfoplanFileBuilder(_base.AbstractCsvFileBuilder):
     def __init__(self, layer: 'Layer'):
@@ -20,18 +28,30 @@ class InfoplanFileBuilder(_base.AbstractCsvFileBuilder):
         self.layer = layer
 
     def make_rows(self):
-
+        """
+        One query for the whole layer: markers joined with their variables (and fingerpost sides),
+        rows of one marker are consecutive, so csv rows are yielded marker by marker
+        """
         need_split = self.layer.kind.is_fingerpost
+        fields = ['uid', 'floor__floor_caption', 'ordinal', 'markervariable__side', 'markervariable__value']
         if need_split:
-            return tuple(itertools.chain.from_iterable(
-                marker_rows_split(m, m.number)      # returns list of rows
-                for m in Marker.objects.filter(layer=self.layer)
-            ))
+            fields += [f'markerfingerpost__side{n}_enabled' for n in FINGERPOST_SIDES]
+        rows = Marker.objects \
+            .filter(layer=self.layer) \
+            .order_by('ordinal', 'uid', 'markervariable__side', 'markervariable__key') \
+            .values_list(*fields) \
+            .iterator(chunk_size=ROWS_CHUNK_SIZE)
 
-        return [
-            marker_rows_single(m, m.number)
-            for m in Marker.objects.filter(layer=self.layer)
-        ]
+        for (_, floor_caption, ordinal), marker_rows in itertools.groupby(rows, key=operator.itemgetter(0, 1, 2)):
+            marker_rows = list(marker_rows)
+            number = Marker.format_number(self.layer.title, floor_caption, ordinal)
+            # marker without variables has one row of nulls from left join
+            variables = [(side, value) for _, _, _, side, value, *_ in marker_rows if side is not None]
+            if need_split:
+                enabled_sides = dict(zip(FINGERPOST_SIDES, marker_rows[0][5:]))
+                yield from marker_rows_split(variables, enabled_sides, number)
+            else:
+                yield marker_rows_single([value for _, value in variables], number)
 
 
 def variables_to_row(variables_list, marker_number: str, number_suffix: str = None) -> List[str]:
@@ -49,11 +69,11 @@ def variables_to_row(variables_list, marker_number: str, number_suffix: str = No
     return prefix + variables_list
 
 
-def marker_rows_split(marker: Marker, marker_number: str) -> Generator[List[str], None, None]:
+def marker_rows_split(variables: Iterable[Tuple[int, str]], enabled_sides: Dict[int, bool],
+                      marker_number: str) -> Generator[List[str], None, None]:
     side_buckets = collections.defaultdict(list)
-    side_data = marker.markerfingerpost_set.first()
-    for value, side in marker.markervariable_set.values_list('value', 'side'):
-        if side_data.is_enabled(side):
+    for side, value in variables:
+        if enabled_sides.get(side):
             side_buckets[side].append(html.unescape(value))
 
     # each side becomes new line ihn file
@@ -63,16 +83,6 @@ def marker_rows_split(marker: Marker, marker_number: str) -> Generator[List[str]
             yield variables_to_row([variable], marker_number, number_suffix=f'{side}{var_letter}')
 
 
-def marker_rows_single(marker: Marker, marker_number: str) -> List[str]:
-    singular_side = ''
-    variables = [
-        (
-            singular_side,
-            [
-                html.unescape(value)
-                for value in marker.markervariable_set.values_list('value', flat=True)
-            ]
-        )
-    ]
-    _, all_variables = variables[0]
+def marker_rows_single(values: Iterable[str], marker_number: str) -> List[str]:
+    all_variables = [html.unescape(value) for value in values]
     return variables_to_row(all_variables, marker_number)
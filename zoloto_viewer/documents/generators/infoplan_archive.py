@@ -3,24 +3,29 @@ import typing as t
 import tarfile
 
 
-def make_tar_archive(files: t.Tuple[t.Union[str,
-                                            t.Tuple[str, str],
-                                            t.Tuple[io.BytesIO, str]]]) -> io.BytesIO:
+def make_tar_archive(files: t.Iterable[t.Union[str,
+                                               t.Tuple[str, str],
+                                               t.Tuple[t.BinaryIO, str]]],
+                     fileobj: t.BinaryIO = None, compress=False) -> t.BinaryIO:
     """
-    :param files: iterable of either file paths or tuples (path, name)
-    :return: io.BytesIO (not closed, for django save to FieldFile)
+    :param files: iterable of either file paths or tuples (path, name) or (file object, name),
+        consumed lazily, so files may be still downloading while previous ones are written
+    :param fileobj: archive is written to it, new io.BytesIO by default
+    :param compress: gzip archive (tar.gz)
+    :return: fileobj (not closed, for django save to FieldFile)
     """
-    buffer = io.BytesIO()
-    with tarfile.TarFile(fileobj=buffer, mode='w') as archive:
+    buffer = fileobj if fileobj is not None else io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz' if compress else 'w') as archive:
         for f in files:
             if isinstance(f, str):
                 archive.add(f)
             else:
                 target, name = f
-                if isinstance(target, io.BytesIO):
+                if isinstance(target, str):
+                    archive.add(target, arcname=name)
+                else:
                     tarinfo = tarfile.TarInfo(name=name)
-                    tarinfo.size = len(target.getvalue())
+                    tarinfo.size = target.seek(0, io.SEEK_END)
+                    target.seek(0)
                     archive.addfile(tarinfo, target)
-                else:
-                    archive.add(target, arcname=name)
     return buffer
@@ -0,0 +1,46 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPEAT = 5
+
+# то, что запускают веб-процессы и management команды
+STARTUP_SNIPPETS = {
+    'manage.py check': 'from django.core.management import execute_from_command_line; '
+                       'execute_from_command_line(["manage.py", "check"])',
+    'wsgi application': 'from zoloto_viewer.config.wsgi import application',
+}
+# так старт выглядел, когда documents.models импортировал pdf_generation, а layout загружал шрифты при импорте
+EAGER_PDF_IMPORT = 'import django; django.setup(); ' \
+                   'from zoloto_viewer.documents.pdf_generation import main, layout; layout.load_fonts(); '
+PDF_MODULES = ('reportlab', 'numpy', 'zoloto_viewer.documents.pdf_generation.main')
+
+
+def measure(snippet, repeat=REPEAT):
+    """Median wall time of fresh interpreter running snippet, and pdf modules it has imported"""
+    code = f'{snippet}\nimport sys; print([m for m in {PDF_MODULES!r} if m in sys.modules])'
+    timings = []
+    loaded = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+        timings.append(time.perf_counter() - started)
+        loaded = result.stdout.strip().splitlines()[-1]
+    return statistics.median(timings), loaded
+
+
+def run_import_benchmark():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zoloto_viewer.config.settings.dev')
+
+    for title, snippet in STARTUP_SNIPPETS.items():
+        lazy, lazy_loaded = measure(snippet)
+        eager, eager_loaded = measure(EAGER_PDF_IMPORT + snippet)
+        print(f'{title}: {lazy:.3f}s, {lazy_loaded}')
+        print(f'{title} with pdf stack: {eager:.3f}s, {eager_loaded}')
+        print(f'{title} startup gain: {eager - lazy:.3f}s ({(eager - lazy) / eager:.0%})')
+
+
+if __name__ == '__main__':
+    run_import_benchmark()
@@ -0,0 +1,119 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from zoloto_viewer.documents.models import ProjectFile
+from zoloto_viewer.infoplan.models import Marker, MarkerVariable
+from zoloto_viewer.viewer.models import Project
+
+BENCHMARK_USERNAME = 'benchmark'
+BULK_API_BATCH = 100
+
+
+class Command(BaseCommand):
+    help = 'Times pdf generation, csv builders, project page and bulk apis of a project ' \
+           '(see make_synthetic_project), results are written to json file to compare runs. ' \
+           'N.B. submit_markers_bulk case copies variables of one marker to markers of the same kind, ' \
+           'so use it with synthetic projects only'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_id', type=int)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--repeat', type=int, default=3, help='runs of every case except pdf')
+        parser.add_argument('--skip-pdf', action='store_true')
+
+    def handle(self, *args, project_id, output, repeat, skip_pdf, **options):
+        project = Project.objects.get(id=project_id)
+        results = {
+            'project': {
+                'id': project.id,
+                'title': project.title,
+                'floors': project.page_set.count(),
+                'layers': project.layer_set.count(),
+                'markers': Marker.objects.filter(floor__project=project).count(),
+                'variables': MarkerVariable.objects.filter(marker__floor__project=project).count(),
+            },
+            'settings': {
+                name: getattr(settings, name)
+                for name in ('PDF_LAYOUT_WORKERS', 'PDF_PLAN_DPI', 'PDF_CAPTION_TIME_BUDGET', 'PDF_MESSAGES_PACKING')
+            },
+            'started': timezone.now().isoformat(),
+            'cases': {},
+        }
+
+        def run(case, fn, times=repeat):
+            results['cases'][case] = measure(fn, times)
+            self.stdout.write(f'{case}: {results["cases"][case]["median"]:.3f}s, '
+                              f'{results["cases"][case]["queries"]} queries')
+
+        if not skip_pdf:
+            run('pdf', lambda: ProjectFile.objects.pdf_generate_file(project), times=1)
+            pdf_file = ProjectFile.objects.filter(project=project, kind=ProjectFile.FileKinds.PDF_EXFOLIATION).first()
+            results['pdf_report'] = pdf_file.generation_report
+
+        for kind, builder_cls in ProjectFile.FILE_BUILDERS.items():
+            if kind == ProjectFile.FileKinds.CSV_INFOPLAN:
+                run(kind.name.lower(), lambda: [consume(builder_cls(L)) for L in project.layer_set.all()])
+            else:
+                run(kind.name.lower(), lambda: consume(builder_cls(project)))
+
+        client = Client()
+        client.force_login(get_user_model().objects.get_or_create(username=BENCHMARK_USERNAME)[0])
+        for floor in project.page_set.all():
+            run(f'project_page {floor.floor_caption}',
+                lambda: check_response(client.get(reverse('project_page', args=[floor.code]))))
+
+        markers = list(Marker.objects.filter(floor__project=project).select_related('layer__kind')[:BULK_API_BATCH])
+        if markers:
+            fetch_request = {'markers': [str(m.uid) for m in markers]}
+            run('fetch_markers_bulk', lambda: check_response(
+                client.post(reverse('fetch_markers_bulk'), json.dumps(fetch_request), content_type='application/json')
+            ))
+            submit_request = {
+                'markers': [str(m.uid) for m in markers if m.layer.kind_id == markers[0].layer.kind_id],
+                'infoplan': MarkerVariable.objects.vars_of_marker_by_side(markers[0]),
+            }
+            run('submit_markers_bulk', lambda: check_response(
+                client.post(reverse('submit_markers_bulk'), json.dumps(submit_request), content_type='application/json')
+            ))
+
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+
+def measure(fn, times):
+    timings = []
+    queries = 0
+    for _ in range(times):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.monotonic()
+            fn()
+            timings.append(time.monotonic() - started)
+        queries = len(captured)
+    return {
+        'seconds': [round(t, 3) for t in timings],
+        'median': round(statistics.median(timings), 3),
+        'queries': queries,
+    }
+
+
+def consume(builder):
+    """Streaming mode, as builders are used by ProjectFile"""
+    for _ in builder.iter_encoded():
+        pass
+
+
+def check_response(response):
+    if response.status_code != 200:
+        raise RuntimeError(f'{response.request["PATH_INFO"]} responded {response.status_code}')
+    return response
@@ -0,0 +1,21 @@
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand
+
+from zoloto_viewer.documents.utils.synthetic_project import SyntheticProjectSpec, create_synthetic_project
+
+
+class Command(BaseCommand):
+    help = 'Creates reproducible synthetic project of given size for benchmarks (see benchmark_project)'
+
+    def add_arguments(self, parser):
+        for f in fields(SyntheticProjectSpec):
+            parser.add_argument(f'--{f.name.replace("_", "-")}', type=int, default=f.default)
+        parser.add_argument('--title', help='by default built from size and seed')
+
+    def handle(self, *args, **options):
+        spec = SyntheticProjectSpec(**{f.name: options[f.name] for f in fields(SyntheticProjectSpec)})
+        project = create_synthetic_project(spec, title=options['title'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created project id={project.id} title={project.title}: {spec}'
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.2 on 2026-10-18 12:00
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_auto_20210424_1939'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectfile',
+            name='generation_report',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.2 on 2026-10-18 18:00
+
+from django.db import migrations
+
+# ProjectFile.FileKinds.CSV_PICT_CODES, pict list is streamed to the response and not stored anymore
+CSV_PICT_CODES = 5
+
+
+def remove_pict_list_files(apps, schema_editor):
+    ProjectFile = apps.get_model('documents', 'ProjectFile')
+    # post_delete receiver of ProjectFile is not called for historical models, files are deleted here
+    for pf in ProjectFile.objects.filter(kind=CSV_PICT_CODES):
+        if pf.file:
+            pf.file.delete(save=False)
+        pf.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_projectfile_generation_report'),
+    ]
+
+    operations = [
+        migrations.RunPython(code=remove_pict_list_files, reverse_code=migrations.RunPython.noop),
+    ]
@@ -1,13 +1,18 @@
-import io
+import functools
 import os
+import tempfile
+import time
+from concurrent import futures
+from django.conf import settings
+from django.contrib.postgres import fields
 from django.core.files import File
-from django.db import models
+from django.db import connections, models
 from django.dispatch import receiver
 
 from zoloto_viewer.documents import generators
-from zoloto_viewer.documents.pdf_generation import main as pdf_module
+from zoloto_viewer.documents.utils.generation_report import GenerationReport
 from zoloto_viewer.infoplan.models import Marker
-from zoloto_viewer.config.settings .storage_backends import s3_download_bytes
+from zoloto_viewer.config.settings .storage_backends import s3_client, s3_download_bytes
 
 
 def additional_files_upload_path(obj: 'ProjectFile', filename):
@@ -27,6 +32,8 @@ class ProjectFilesManager(models.Manager):
             project=project,
             kind=kind
         ).first()
+        if existing_file:
+            existing_file.project = project     # freshness check doesn't load it again
         if existing_file and existing_file.is_fresh_project_file():
             return existing_file
         else:
@@ -53,32 +60,65 @@ class ProjectFilesManager(models.Manager):
     def generate_counts(self, project):
         return self.create_csv_file(project, self.model.FileKinds.CSV_LAYER_STATS)
 
-    def generate_pict_list(self, project):
-        return self.create_csv_file(project, self.model.FileKinds.CSV_PICT_CODES)
-
     def generate_vars_index_file(self, project):
         return self.create_csv_file(project, self.model.FileKinds.CSV_VARIABLES)
 
     def _generate_layer_infoplan(self, layer):
         return self.create_layer_csv_file(layer.project, self.model.FileKinds.CSV_INFOPLAN, layer)
 
-    def generate_infoplan_archive(self, project):
-        per_layer_csv_files = []
-        for layer in project.layer_set.all():
-            layer_infoplan = self.infoplan_file(layer)  # type: ProjectFile
-            # `last_modified and last_modified > date_created` to treat empty layers as up-to-date
-            if not (layer_infoplan and layer_infoplan.is_fresh_layer_file()):
-                layer_infoplan = self._generate_layer_infoplan(layer)
-            per_layer_csv_files.append(
-                (s3_download_bytes(layer_infoplan.file.name),
-                 layer_infoplan.public_name)
-            )
+    def generate_infoplan_archive(self, project, workers=None):
+        """
+        Stale layer files are regenerated and all of them are downloaded by a pool of threads (if workers > 1),
+        archive is written while the rest of layers are still in progress
+        """
+        if workers is None:
+            workers = settings.INFOPLAN_ARCHIVE_WORKERS
+        report = GenerationReport()
+        layers = list(project.layer_set.all())
+        layer_files = {}
+        for pf in self.filter(project=project, kind=self.model.FileKinds.CSV_INFOPLAN):
+            pf.project = project
+            layer_files[pf.layer_id] = pf
+
+        def fetch(layer):
+            return self._layer_infoplan_bytes(layer, layer_files.get(layer.id))
+
+        def archive_files(results):
+            for buf, name, seconds in results:
+                report.add('layer files', seconds)
+                yield buf, name
 
         kind = self.model.FileKinds.TAR_INFOPLAN
         obj = self.model(project=project, kind=kind)
-        obj._setup_archive_file(per_layer_csv_files)
+        s3_client()     # shared by download threads
+        if workers > 1 and len(layers) > 1:
+            with futures.ThreadPoolExecutor(max_workers=min(workers, len(layers))) as pool:
+                obj._setup_archive_file(archive_files(pool.map(_closing_db_connections(fetch), layers)), report)
+        else:
+            obj._setup_archive_file(archive_files(map(fetch, layers)), report)
         return obj
 
+    def _layer_infoplan_bytes(self, layer, layer_infoplan):
+        started = time.monotonic()
+        if layer_infoplan:
+            layer_infoplan.layer = layer
+        # `last_modified and last_modified > date_created` to treat empty layers as up-to-date
+        if not (layer_infoplan and layer_infoplan.is_fresh_layer_file()):
+            layer_infoplan = self._generate_layer_infoplan(layer)
+        buf = s3_download_bytes(layer_infoplan.file.name)
+        return buf, layer_infoplan.public_name, time.monotonic() - started
+
+
+def _closing_db_connections(fn):
+    """For pool threads: django opens a connection per thread and doesn't close it"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connections.close_all()
+    return wrapper
+
 
 class ProjectFile(models.Model):
     """
@@ -90,7 +130,7 @@ class ProjectFile(models.Model):
         CSV_LAYER_STATS = 2     # кол-во
         CSV_INFOPLAN = 3        # инфоплан одного слоя
         CSV_VARIABLES = 4       # словарь
-        CSV_PICT_CODES = 5      # пикты
+        CSV_PICT_CODES = 5      # пикты, не хранится: строится при каждом запросе
         TAR_INFOPLAN = 6        # архив с инфопланами по слоям
 
     project = models.ForeignKey('viewer.Project', on_delete=models.CASCADE)
@@ -99,6 +139,8 @@ class ProjectFile(models.Model):
     kind = models.IntegerField(choices=FileKinds.choices)
     date_created = models.DateTimeField(auto_now_add=True)
     layer = models.ForeignKey('viewer.Layer', on_delete=models.CASCADE, null=True)
+    # GenerationReport.to_json(): total and per stage seconds spent building the file
+    generation_report = fields.JSONField(null=True)
 
     objects = ProjectFilesManager()
 
@@ -110,7 +152,8 @@ class ProjectFile(models.Model):
     }
 
     @staticmethod
-    def make_name(kind, *, project, **extra):
+    def make_name(kind, *, project, compressed=None, **extra):
+        """:param compressed: archive is gzipped, by default settings.INFOPLAN_ARCHIVE_GZIP"""
         file_kinds = ProjectFile.FileKinds
         rules = {
             file_kinds.CSV_LAYER_STATS  : 'project_{project.title}_marker_counts.csv',
@@ -120,7 +163,12 @@ class ProjectFile(models.Model):
             file_kinds.TAR_INFOPLAN     : 'project_{project.title}_infoplan.tar',
             file_kinds.PDF_EXFOLIATION  : 'project_{project.title}_pdf.pdf',
         }
-        return rules[kind].format(project=project, **extra)
+        name = rules[kind].format(project=project, **extra)
+        if compressed is None:
+            compressed = settings.INFOPLAN_ARCHIVE_GZIP
+        if kind == file_kinds.TAR_INFOPLAN and compressed:
+            name += '.gz'
+        return name
 
     @property
     def file_name(self):
@@ -134,6 +182,9 @@ class ProjectFile(models.Model):
         extra = {}
         if self.kind == self.FileKinds.CSV_INFOPLAN:
             extra['layer'] = self.layer
+        if self.kind == self.FileKinds.TAR_INFOPLAN and self.file:
+            # stored archive may be built before INFOPLAN_ARCHIVE_GZIP was changed
+            extra['compressed'] = self.file.name.endswith('.gz')
         return self.__class__.make_name(self.kind, project=self.project, **extra)
 
     def _setup_file(self):
@@ -141,31 +192,60 @@ class ProjectFile(models.Model):
         if not builder_cls:
             raise NotImplementedError(f'ProjectFile.FILE_BUILDERS no value for key {self.kind}')
 
+        report = GenerationReport()
         builder = builder_cls(self.project)     # type: generators.AbstractCsvFileBuilder
-        builder.build()
-        self.file.save(self._make_name(), File(builder.buffer_bytes))
+        self._save_csv(builder, self._make_name(), report)
+        self._save_with_report(report)
 
     def _setup_layer_file(self):
         builder_cls = self.FILE_BUILDERS.get(self.kind)
         if not builder_cls:
             raise NotImplementedError(f'ProjectFile.FILE_BUILDERS no value for key {self.kind}')
 
+        report = GenerationReport()
         builder = builder_cls(self.layer)       # type: generators.AbstractCsvFileBuilder
-        builder.build()
         filename = self.__class__.make_name(self.kind, project=self.project, layer=self.layer)
-        self.file.save(filename, File(builder.buffer_bytes))
+        self._save_csv(builder, filename, report)
+        self._save_with_report(report)
+
+    def _save_csv(self, builder: generators.AbstractCsvFileBuilder, filename, report: GenerationReport):
+        # csv is encoded by chunks, s3 storage needs seekable file to upload, so it's spooled
+        with tempfile.SpooledTemporaryFile(max_size=settings.CSV_SPOOL_MAX_SIZE) as csv_file:
+            with report.stage('csv build'):
+                builder.write_to(csv_file)
+            with report.stage('storage upload'):
+                self.file.save(filename, File(csv_file), save=False)
 
     def _setup_pdf_file(self):
         self.kind = self.FileKinds.PDF_EXFOLIATION
-        bytes_buf = io.BytesIO()
-        filename = self.__class__.make_name(self.kind, project=self.project)
-        pdf_module.generate_pdf(self.project, bytes_buf, filename)
-        self.file.save(filename, File(bytes_buf))
+        # pdf_generation тянет reportlab, numpy и шрифты, в веб-процессах они не нужны
+        from zoloto_viewer.documents.pdf_generation import main as pdf_module
 
-    def _setup_archive_file(self, files):
-        bytes_buf = generators.infoplan_archive.make_tar_archive(files)
+        report = GenerationReport()
         filename = self.__class__.make_name(self.kind, project=self.project)
-        self.file.save(filename, File(bytes_buf))
+        # большие документы уходят на диск, а storage читает их частями (для s3 это multipart upload)
+        with tempfile.SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_SIZE) as pdf_file:
+            pdf_module.generate_pdf(self.project, pdf_file, filename, report=report)
+            with report.stage('storage upload'):
+                self.file.save(filename, File(pdf_file), save=False)
+        self._save_with_report(report)
+
+    def _setup_archive_file(self, files, report: GenerationReport):
+        compress = settings.INFOPLAN_ARCHIVE_GZIP
+        filename = self.__class__.make_name(self.kind, project=self.project, compressed=compress)
+        with tempfile.SpooledTemporaryFile(max_size=settings.INFOPLAN_ARCHIVE_SPOOL_MAX_SIZE) as archive_file:
+            # layer files are downloaded while archive is being built
+            with report.stage('archive build'):
+                generators.infoplan_archive.make_tar_archive(files, archive_file, compress=compress)
+            with report.stage('storage upload'):
+                self.file.save(filename, File(archive_file), save=False)
+        self._save_with_report(report)
+
+    def _save_with_report(self, report: GenerationReport):
+        report.finish()
+        report.log(f'{self.public_name}:')
+        self.generation_report = report.to_json()
+        self.save()
 
     def is_fresh_project_file(self):
         markers_last_modified = Marker.objects.max_last_modified(project=self.project)
@@ -0,0 +1,156 @@
+import logging
+import numpy as np
+import time
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .plan import BoundsIndex, MarkerCaption, Object, ObjectsConfiguration
+
+logger = logging.getLogger(__name__)
+
+_H = MarkerCaption.CAPTION_FONT_SIZE
+# варианты положения подписи в порядке предпочтения
+PLACEMENT_TUNING_OPTIONS = [
+    # (increase_a, cross_delta, comment)
+    (None, None, 'default place'),
+
+    (180, None, 'a + 180 place'),
+    (90,  None, 'a + 90 place'),
+    (270, None, 'a + 270 place'),
+
+    (None, -_H,     'default:-h'),
+    (None, -2 * _H, 'default:-2h'),
+    (None, _H,      'default:+h'),
+    (None, 2 * _H,  'default:+2h'),
+    (180,  -_H,     'a + 180:-h'),
+    (180,  -2 * _H, 'a + 180:-2h'),
+    (180,  _H,      'a + 180:+h'),
+    (180,  2 * _H,  'a + 180:+2h'),
+    (90,   -_H,     'a + 90:-h'),
+    (90,   -2 * _H, 'a + 90:-2h'),
+    (90,   _H,      'a + 90:+h'),
+    (90,   2 * _H,  'a + 90:+2h'),
+    (270,  -_H,     'a + 270:-h'),
+    (270,  -2 * _H, 'a + 270:-2h'),
+    (270,  _H,      'a + 270:+h'),
+    (270,  2 * _H,  'a + 270:+2h'),
+]
+PLACEMENT_CANDIDATES = [(increase_a, cross_delta) for increase_a, cross_delta, _ in PLACEMENT_TUNING_OPTIONS]
+
+
+@dataclass
+class PlacementMetrics:
+    captions: int = 0
+    candidates_evaluated: int = 0
+    repair_passes: int = 0
+    repair_moves: int = 0
+    collisions_remaining: int = 0      # captions with more collisions than allowed
+    elapsed: float = 0.
+    budget_exhausted: bool = False
+
+    def __str__(self):
+        return f'{self.captions} captions, {self.collisions_remaining} colliding, ' \
+               f'{self.candidates_evaluated} candidates evaluated, ' \
+               f'{self.repair_passes} repair passes ({self.repair_moves} moves), ' \
+               f'{self.elapsed:.2f}s{" budget exhausted" if self.budget_exhausted else ""}'
+
+
+class CaptionPlacementEngine:
+    """
+    Расстановка подписей с ограничением по времени (anytime): сначала жадный проход от самых плотных
+    областей этажа (ObjectsConfiguration.density_rank), каждой подписи - вариант с наименьшим числом пересечений,
+    затем, пока есть время, повторные проходы по подписям с пересечениями, которые переставляются
+    с учётом уже всех остальных подписей. Жадный проход выполняется всегда целиком,
+    так что бюджет 0 даёт самый быстрый черновой результат
+    """
+
+    def __init__(self, canvas, bb_index: BoundsIndex,
+                 time_budget: Optional[float] = None, max_collisions_allowed: int = 0):
+        """
+        :param time_budget: seconds for repair passes, None means until no caption can be improved
+        :param max_collisions_allowed: caption having not more collisions is not repaired
+        """
+        self.canvas = canvas
+        self.bb_index = bb_index
+        self.time_budget = time_budget
+        self.max_collisions_allowed = max_collisions_allowed
+        self.metrics = PlacementMetrics()
+
+        self._candidates: Dict[int, Tuple[np.ndarray, list]] = {}   # id(caption) -> candidate_rects()
+        self._chosen: Dict[int, int] = {}                           # id(caption) -> candidate index
+
+    def place(self, marker_objects: List[Object]) -> List[MarkerCaption]:
+        """Returns captions in marker_objects order"""
+        started = time.monotonic()
+        captions = [obj.caption() for obj in marker_objects]
+        self.metrics.captions = len(captions)
+
+        for obj in self._density_order(marker_objects):
+            self._place_best(obj.caption())
+        self._repair(captions, deadline=None if self.time_budget is None else started + self.time_budget)
+
+        self.metrics.collisions_remaining = sum(
+            self._current_collisions(caption) > self.max_collisions_allowed
+            for caption in captions
+        )
+        self.metrics.elapsed = time.monotonic() - started
+        return captions
+
+    def _density_order(self, marker_objects: List[Object]) -> List[Object]:
+        if len(marker_objects) < 2:
+            return marker_objects
+        # индекс построен по этим же объектам; нужен только ранг плотности, без списков соседей
+        return ObjectsConfiguration(self.bb_index.objects_bounds, max_neighbours=1).density_rank
+
+    def _repair(self, captions: List[MarkerCaption], deadline: Optional[float]):
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                self.metrics.budget_exhausted = True
+                return
+            colliding = [
+                caption for caption in captions
+                if self._current_collisions(caption) > self.max_collisions_allowed
+            ]
+            if not colliding:
+                return
+            self.metrics.repair_passes += 1
+            moves_before = self.metrics.repair_moves
+            for caption in colliding:
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.metrics.budget_exhausted = True
+                    return
+                self.bb_index.remove_marker(caption.bounding_box)
+                self._place_best(caption)
+            if self.metrics.repair_moves == moves_before:   # local optimum
+                return
+
+    def _place_best(self, caption: MarkerCaption):
+        rects, params = self._caption_candidates(caption)
+        collision_counts = self.bb_index.collision_counts(rects, own_obj=caption.obj)
+        self.metrics.candidates_evaluated += len(rects)
+
+        best = int(np.argmin(collision_counts))     # first of least colliding
+        current = self._chosen.get(id(caption))
+        if current is not None:
+            if collision_counts[best] >= collision_counts[current]:
+                best = current
+            else:
+                self.metrics.repair_moves += 1
+
+        self._chosen[id(caption)] = best
+        offset, need_rotate = params[best]
+        caption.set_box_params(offset=offset, need_rotate=need_rotate)
+        self.bb_index.write(caption.get_bounding_box(self.canvas, force_update=True))
+
+    def _caption_candidates(self, caption: MarkerCaption) -> Tuple[np.ndarray, list]:
+        key = id(caption)
+        if key not in self._candidates:
+            self._candidates[key] = caption.candidate_rects(PLACEMENT_CANDIDATES)
+        return self._candidates[key]
+
+    def _current_collisions(self, caption: MarkerCaption) -> int:
+        rects, _ = self._caption_candidates(caption)
+        current = rects[self._chosen[id(caption)]][np.newaxis]
+        # caption itself is in the index
+        return int(self.bb_index.collision_counts(current, own_obj=caption.obj)[0]) - 1
@@ -1,3 +1,5 @@
+import functools
+import hashlib
 import os
 import re
 
@@ -9,6 +11,7 @@ from reportlab.pdfbase import pdfmetrics, ttfonts
 from reportlab.pdfgen.canvas import Canvas
 
 ADD_FONTS_LOADED = False
+STRING_WIDTH_CACHE_SIZE = 2 ** 16
 
 
 class Definitions:
@@ -105,6 +108,10 @@ def mess_area_size():
 
 
 def load_fonts():
+    """
+    Регистрирует шрифты в reportlab один раз на процесс, при первом построении pdf, а не при импорте:
+    веб-процессам шрифты не нужны. Процессы расчёта раскладки (fork) получают их уже загруженными
+    """
     global ADD_FONTS_LOADED
     if ADD_FONTS_LOADED:
         return
@@ -118,7 +125,14 @@ def load_fonts():
     ADD_FONTS_LOADED = True
 
 
-load_fonts()
+@functools.lru_cache(maxsize=STRING_WIDTH_CACHE_SIZE)
+def string_width(text, font_name, font_size):
+    """
+    Same as canvas.setFont(font_name, font_size); canvas.stringWidth(text),
+    memoized per process, counters are available with string_width.cache_info()
+    """
+    load_fonts()
+    return pdfmetrics.stringWidth(text, font_name, font_size)
 
 
 def draw_header(canvas: Canvas, title, super_title):
@@ -145,12 +159,36 @@ def draw_header(canvas: Canvas, title, super_title):
 
 
 def draw_footer(canvas):
+    d = Definitions
+    draw_as_form(canvas, 'footer', lambda: _draw_footer_static(canvas))
+
+    canvas.setFont(d.FOOTER_FONT_NAME, d.FOOTER_FONT_SIZE)
+    canvas.drawRightString(d.BOUND_RIGHT, d.PADDING_FOOTER, str(canvas.getPageNumber()))
+
+
+def _draw_footer_static(canvas):
     d = Definitions
     canvas.line(d.BOUND_LEFT, d.BOTTOM_LINE, d.BOUND_RIGHT, d.BOTTOM_LINE)
 
     canvas.setFont(d.FOOTER_FONT_NAME, d.FOOTER_FONT_SIZE)
     canvas.drawString(d.BOUND_LEFT, d.PADDING_FOOTER, 'z')
-    canvas.drawRightString(d.BOUND_RIGHT, d.PADDING_FOOTER, str(canvas.getPageNumber()))
+
+
+def draw_as_form(canvas: Canvas, form_name, draw):
+    """
+    Повторяющийся на страницах элемент встраивается в документ один раз как form xobject,
+    draw() вызывается только при первом использовании, дальше страницы только ссылаются на форму
+    """
+    if not canvas.hasForm(form_name):
+        canvas.beginForm(form_name)
+        draw()
+        canvas.endForm()
+    canvas.doForm(form_name)
+
+
+def form_name_digest(prefix, *content):
+    """Form name unique for content, content must have stable repr"""
+    return f'{prefix}_{hashlib.sha1(repr(content).encode()).hexdigest()}'
 
 
 class AbstractPageWriter(ABC):
@@ -186,7 +224,9 @@ class BasePageWriter(AbstractPageWriter, ABC):
         self._super_title = super_title
 
     def draw_header(self):
-        draw_header(self.canvas, self._title, self._super_title)
+        # заголовок общий для всех страниц этажа
+        form_name = form_name_digest('header', self._title, self._super_title)
+        draw_as_form(self.canvas, form_name, lambda: draw_header(self.canvas, self._title, self._super_title))
 
     def draw_footer(self):
         draw_footer(self.canvas)
@@ -1,21 +1,71 @@
+import functools
+import io
 import itertools
 import logging
+import multiprocessing
+import time
 
+from concurrent import futures
+from dataclasses import dataclass, field
+from django.conf import settings
 from reportlab.pdfgen import canvas as reportlab_canvas
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from zoloto_viewer.viewer.models import Project, Page, Layer, LayerGroup
-from zoloto_viewer.infoplan.models import Marker, MarkerFingerpost, MarkerVariable
+from zoloto_viewer.infoplan.models import CaptionPlacement
 from zoloto_viewer.infoplan.utils import variable_transformations as transformations
+from zoloto_viewer.documents.utils import placement_redis_cache
+from zoloto_viewer.documents.utils.generation_report import GenerationReport
 
 from . import layout, message_page_writer as message, plan
+from .caption_placement import PlacementMetrics
 from .plan_page_writer import PlanPageWriterMinimal
-from .plan_page_writer_simple import PlanPageWriterLayerGroupsSimple
+from .plan_page_writer_simple import CaptionPlace, PlanPageWriterLayerGroupsSimple
+from .snapshot import ProjectSnapshot
 
 logger = logging.getLogger(__name__)
 
+# part of cached floor layouts digest, increment when layout computation or pickled layout classes change
+LAYOUT_VERSION = 5
+
+# snapshot inherited by forked layout workers, see compute_floor_layouts_parallel
+_worker_snapshot: Optional[ProjectSnapshot] = None
+
+
+@dataclass
+class GroupLayout:
+    marker_objects: List[plan.Object]
+    db_placed_captions: List[plan.MarkerCaption]
+    not_placed_captions: List[plan.MarkerCaption]
+    placement_metrics: Optional[PlacementMetrics] = None
+
+
+@dataclass
+class FloorLayout:
+    """Всё, что считается для этажа до рисования: объекты, подписи по группам слоёв и страницы сообщений"""
+    marker_objects: List[plan.Object]
+    groups: Dict[int, GroupLayout]     # layer group id -> layout, groups without active markers omitted
+    message_pages: List[List[message.MessagePlacement]]
+    # stage name -> seconds spent computing that layout, in whatever process it was done
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def generate_pdf(project: Project, buffer, filename, workers: Optional[int] = None,
+                 report: Optional[GenerationReport] = None):
+    """
+    :param workers: number of processes computing floor layouts,
+     by default settings.PDF_LAYOUT_WORKERS, 1 means everything is done serially
+    :param report: per-stage timings are added to it
+    """
+    if workers is None:
+        workers = settings.PDF_LAYOUT_WORKERS
+    if report is None:
+        report = GenerationReport()
+    layout.load_fonts()     # before the pool is forked
+    with report.stage('data load'):
+        snapshot = load_snapshot(project)
+    new_caption_placements = []
 
-def generate_pdf(project: Project, buffer, filename):
     canvas = reportlab_canvas.Canvas(buffer, pagesize=layout.Definitions.PAGE_SIZE)
     canvas.setTitle(filename)
     at_canvas_beginning = True
@@ -33,66 +83,266 @@ def generate_pdf(project: Project, buffer, filename):
         return inner
 
     @first_page_canvas_management
-    def draw_plan_no_captions(page, layers):
-        writer = PlanPageWriterMinimal(canvas, page, layers, make_marker_objects_many_layers)
-        writer.write()
+    def draw_plan_no_captions(page, layers, floor_layout: FloorLayout):
+        writer = PlanPageWriterMinimal(canvas, page, layers, lambda *_: floor_layout.marker_objects,
+                                       plan_size=snapshot.plan_size(page))
+        _write_plan_page(writer, report)
 
     @first_page_canvas_management
-    def draw_plan_active_layers_group(page, layers, layers_group):
-        writer = PlanPageWriterLayerGroupsSimple(canvas, page, layers, layers_group, make_marker_objects_many_layers)
-        writer.write()
+    def draw_plan_active_layers_group(page, layers, layers_group, floor_layout: FloorLayout):
+        group_layout = floor_layout.groups.get(layers_group.id)
+        if not group_layout:
+            raise layout.NoMarkersInActiveGroupException
+        writer = PlanPageWriterLayerGroupsSimple(canvas, page, layers, layers_group,
+                                                 lambda *_: group_layout.marker_objects,
+                                                 snapshot.caption_placements(layers_group),
+                                                 captions_db_buffer=new_caption_placements,
+                                                 plan_size=snapshot.plan_size(page))
+        writer.use_prepared_captions(group_layout.db_placed_captions, group_layout.not_placed_captions)
+        _write_plan_page(writer, report)
 
     @first_page_canvas_management
-    def draw_messages(page, layers):
-        writer = message.MessagePageWriter(
-            canvas, page, layers,
-            marker_messages_getter=make_messages_obj_many_layers,
-        )
-        writer.write()
+    def draw_messages(page, layers, floor_layout: FloorLayout):
+        writer = message.MessagePageWriter(canvas, page, layers, marker_messages_getter=lambda *_: [])
+        writer.use_prepared_pages(floor_layout.message_pages)
+        with report.stage('messages draw'):
+            writer.write()
 
-    layer_groups = LayerGroup.objects.filter(project=project)
-    for P in project.page_set.all():
-        page_layers = Layer.objects.filter(marker__floor=P).distinct()
-        draw_plan_no_captions(P, page_layers)
-        for lg in layer_groups:     # type: LayerGroup
+    layouts = floor_layouts(snapshot, workers, report)
+    for P in snapshot.floors:   # type: Page
+        # serial generation computes layouts here, parallel one only waits for them
+        with report.stage('floor layouts'):
+            floor_layout = next(layouts)    # type: FloorLayout
+        page_layers = snapshot.floor_layers(P)
+        draw_plan_no_captions(P, page_layers, floor_layout)
+        for lg in snapshot.layer_groups:    # type: LayerGroup
             try:
-                draw_plan_active_layers_group(P, page_layers, lg)
+                draw_plan_active_layers_group(P, page_layers, lg, floor_layout)
             except layout.NoMarkersInActiveGroupException:
                 # handle that showPage already was called and need to skip next call
                 at_canvas_beginning = True
                 continue
-        draw_messages(P, page_layers)
-    canvas.save()
+        draw_messages(P, page_layers, floor_layout)
+    with report.stage('canvas save'):
+        canvas.save()
+    with report.stage('caption placements store'):
+        store_caption_placements(new_caption_placements)
+    # layout workers keep their own caches
+    logger.info(f'string width cache: {layout.string_width.cache_info()}')
+
+
+def _write_plan_page(writer: PlanPageWriterMinimal, report: GenerationReport):
+    started = time.monotonic()
+    writer.write()
+    image_load_time = writer.plan_image_load_time
+    if image_load_time:
+        report.add('plan image decode', image_load_time)
+    report.add('plan draw', time.monotonic() - started - image_load_time)
+
+
+def load_snapshot(project: Project) -> ProjectSnapshot:
+    filters = [
+        transformations.UnescapeHtml(),
+        transformations.HideMasterPageLine(),
+        transformations.UnescapeTabsText(),
+        transformations.ReplacePictCodes()
+    ]
+    return ProjectSnapshot(project, variable_filters=filters)
+
+
+def store_caption_placements(placements: List[CaptionPlacement]):
+    # one placement per marker, the latest one wins
+    by_marker = {cp.marker_id: cp for cp in placements}
+    CaptionPlacement.objects.filter(marker_id__in=by_marker.keys()).delete()
+    CaptionPlacement.objects.bulk_create(by_marker.values(), batch_size=1000)
+
+
+def floor_layouts(snapshot: ProjectSnapshot, workers: int, report: GenerationReport) -> Iterator[FloorLayout]:
+    """
+    Yields floor layouts in floors order. Layouts of floors not changed since previous generation
+    are taken from cache, others are computed (by a process pool if workers > 1) and cached
+    """
+    with report.stage('layout cache lookup'):
+        digests = {
+            P.uid: snapshot.floor_digest(P, LAYOUT_VERSION,
+                                         settings.PDF_MESSAGES_PACKING, settings.PDF_CAPTION_TIME_BUDGET)
+            for P in snapshot.floors
+        }
+        cached = {
+            P.uid: placement_redis_cache.check_floor_layout(P, digests[P.uid])
+            for P in snapshot.floors
+        }
+    to_compute = [P.uid for P in snapshot.floors if cached[P.uid] is None]
+    logger.info(f'floor layouts: {len(snapshot.floors) - len(to_compute)} cached, {len(to_compute)} to compute')
+
+    if workers > 1 and to_compute:
+        computed = compute_floor_layouts_parallel(snapshot, to_compute, workers)
+    else:
+        computed = (_compute_floor_layout(snapshot, floor_uid) for floor_uid in to_compute)
+
+    for P in snapshot.floors:
+        floor_layout = cached[P.uid]
+        if floor_layout is None:
+            floor_layout = next(computed)
+            for stage, seconds in floor_layout.timings.items():
+                report.add(stage, seconds)
+            with report.stage('layout cache store'):
+                placement_redis_cache.store_floor_layout(P, digests[P.uid], floor_layout)
+        yield floor_layout
+
+
+def compute_floor_layouts_parallel(snapshot: ProjectSnapshot, floor_uids: List, workers: int) -> Iterator[FloorLayout]:
+    """
+    Caption placement of every (floor, layer group) pair and message pagination of every floor are separate
+    pool tasks. Yields floor layouts in floor_uids order, each one as soon as its tasks are done
+    """
+    # fork start method: workers inherit the snapshot and never query the database,
+    # tasks pass ids only and return plain tuples, no ORM backed objects are pickled
+    mp_context = multiprocessing.get_context('fork')
+    with futures.ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                     initializer=_init_layout_worker, initargs=(snapshot,)) as executor:
+        floor_tasks = [
+            (
+                floor_uid,
+                [(lg.id, executor.submit(place_group_captions, floor_uid, lg.id)) for lg in snapshot.layer_groups],
+                executor.submit(paginate_floor_messages, floor_uid),
+            )
+            for floor_uid in floor_uids
+        ]
+        for floor_uid, group_tasks, messages_task in floor_tasks:
+            group_results = {
+                lg_id: result
+                for lg_id, result in ((lg_id, task.result()) for lg_id, task in group_tasks)
+                if result is not None
+            }
+            yield _compute_floor_layout(snapshot, floor_uid,
+                                        group_results=group_results, messages_result=messages_task.result())
+
+
+def _init_layout_worker(snapshot: ProjectSnapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def place_group_captions(floor_uid, layer_group_id) -> Optional[Tuple[List[CaptionPlace], PlacementMetrics]]:
+    """Process pool task: placement of new captions of one layer group page, None if group has no markers"""
+    snapshot = _worker_snapshot
+    layer_group = next(lg for lg in snapshot.layer_groups if lg.id == layer_group_id)
+    try:
+        writer = _make_group_writer(snapshot, snapshot.floor(floor_uid), layer_group)
+    except layout.NoMarkersInActiveGroupException:
+        return None
+    writer.prepare_captions()
+    return writer.new_caption_places, writer.placement_metrics
+
+
+def paginate_floor_messages(floor_uid) -> Tuple[List[List[message.MessagePlacement]], float]:
+    """Process pool task: message pages of one floor and seconds spent"""
+    return _paginate_messages_timed(_worker_snapshot, _worker_snapshot.floor(floor_uid))
+
+
+def _compute_floor_layout(snapshot: ProjectSnapshot, floor_uid,
+                          group_results: Optional[Dict[int, Tuple[List[CaptionPlace], PlacementMetrics]]] = None,
+                          messages_result: Optional[Tuple[List[List[message.MessagePlacement]], float]] = None
+                          ) -> FloorLayout:
+    """
+    :param group_results: layer group id -> new caption places and placement metrics computed by pool tasks,
+     groups without markers omitted; if not passed, placement is done here
+    :param messages_result: message pages and pagination seconds computed by a pool task,
+     if not passed pagination is done here
+    """
+    floor = snapshot.floor(floor_uid)
+    groups = {}
+    timings = {}
+    for lg in snapshot.layer_groups:    # type: LayerGroup
+        if group_results is not None and lg.id not in group_results:
+            continue
+        try:
+            writer = _make_group_writer(snapshot, floor, lg)
+        except layout.NoMarkersInActiveGroupException:
+            continue
+        if group_results is not None:
+            new_places, metrics = group_results[lg.id]
+            writer.prepare_captions(new_places)
+        else:
+            writer.prepare_captions()
+            metrics = writer.placement_metrics
+        groups[lg.id] = GroupLayout(writer.marker_objects, *writer.prepared_captions, placement_metrics=metrics)
+        timings[f'caption placement group {lg.num}'] = metrics.elapsed
+        logger.info(f'floor {floor.floor_caption} layer group {lg.num} captions: {metrics}')
+
+    message_pages, timings['message layout'] = messages_result or _paginate_messages_timed(snapshot, floor)
+    floor_layout = FloorLayout(
+        marker_objects=make_marker_objects_many_layers(snapshot, floor, snapshot.floor_layers(floor)),
+        groups=groups,
+        message_pages=message_pages,
+        timings=timings,
+    )
+    logger.debug(f'floor {floor.floor_caption} layout done, string width cache: {layout.string_width.cache_info()}')
+    return floor_layout
+
+
+def _make_group_writer(snapshot: ProjectSnapshot, floor: Page, layer_group: LayerGroup):
+    """Writer used only to prepare captions, raises NoMarkersInActiveGroupException as usual"""
+    # per floor budget is shared by layer group pages of the floor, negative means no limit
+    time_budget = None
+    if settings.PDF_CAPTION_TIME_BUDGET >= 0:
+        time_budget = settings.PDF_CAPTION_TIME_BUDGET / max(len(snapshot.floor_layer_groups(floor)), 1)
+    return PlanPageWriterLayerGroupsSimple(_measure_canvas(), floor, snapshot.floor_layers(floor), layer_group,
+                                           functools.partial(make_marker_objects_many_layers, snapshot),
+                                           snapshot.caption_placements(layer_group),
+                                           caption_time_budget=time_budget,
+                                           plan_size=snapshot.plan_size(floor))
+
 
+def _paginate_messages_timed(snapshot: ProjectSnapshot, floor: Page
+                             ) -> Tuple[List[List[message.MessagePlacement]], float]:
+    started = time.monotonic()
+    message_pages = _paginate_messages(snapshot, floor)
+    return message_pages, time.monotonic() - started
 
-def make_marker_objects(floor: Page, layer: Layer):
-    marker_positions = Marker.objects.get_positions(floor, layer)
-    marker_numbers = Marker.objects.get_numbers(floor, layer)
-    fingerpost_data = MarkerFingerpost.bulk_serialize(marker_numbers.keys()) if layer.kind.is_fingerpost else {}
+
+def _paginate_messages(snapshot: ProjectSnapshot, floor: Page) -> List[List[message.MessagePlacement]]:
+    messages_writer = message.MessagePageWriter(
+        _measure_canvas(), floor, snapshot.floor_layers(floor),
+        marker_messages_getter=functools.partial(make_messages_obj_many_layers, snapshot),
+        packing=settings.PDF_MESSAGES_PACKING,
+    )
+    return messages_writer.paginate()
+
+
+def _measure_canvas():
+    # only font metrics are used, nothing is written to that canvas
+    layout.load_fonts()
+    return reportlab_canvas.Canvas(io.BytesIO(), pagesize=layout.Definitions.PAGE_SIZE)
+
+
+def make_marker_objects(snapshot: ProjectSnapshot, floor: Page, layer: Layer):
+    marker_positions = snapshot.marker_positions(floor, layer)
+    is_fingerpost = layer.kind.is_fingerpost
     return [
         plan.Object(
-            *marker_positions[marker_uid],
-            number=marker_numbers[marker_uid],
+            *position,
+            number=snapshot.marker_number(marker_uid),
             uid=marker_uid,
             layer=layer,
-            fingerpost_meta=fingerpost_data.get(marker_uid, {}),
+            fingerpost_meta=(snapshot.fingerpost_data(marker_uid) or {}) if is_fingerpost else {},
         )
-        for marker_uid in marker_positions.keys()
-        if marker_uid in marker_numbers.keys()
+        for marker_uid, position in marker_positions.items()
     ]
 
 
-def make_marker_objects_many_layers(floor: Page, layers: List[Layer]):
+def make_marker_objects_many_layers(snapshot: ProjectSnapshot, floor: Page, layers: List[Layer]):
     # logger.debug('start make_marker_objects_many_layers')
     marker_positions = list(itertools.chain.from_iterable(
-        make_marker_objects(floor, L)
+        make_marker_objects(snapshot, floor, L)
         for L in layers
     ))
     # logger.debug('end make_marker_objects_many_layers')
     return marker_positions
 
 
-def make_messages_obj(floor: Page, layer: Layer):
+def make_messages_obj(snapshot: ProjectSnapshot, floor: Page, layer: Layer):
     def marker_infoplan(vars_info_by_side, marker_uid, side_keys):
         return [
             (
@@ -105,35 +355,23 @@ def make_messages_obj(floor: Page, layer: Layer):
             for side_key in side_keys
         ]
 
-    filters = [
-        transformations.UnescapeHtml(),
-        transformations.HideMasterPageLine(),
-        transformations.UnescapeTabsText(),
-        transformations.ReplacePictCodes()
-    ]
-    vars_by_side, _ = MarkerVariable.objects.vars_page_layer_by_side(floor, layer, apply_transformations=filters)
-    marker_numbers = Marker.objects.get_numbers(floor, layer)
-
-    fingerpost_data = {}
-    if layer.kind.is_fingerpost:
-        fingerpost_data = MarkerFingerpost.objects.filter(marker__layer=layer).bulk_serialize()
-
+    is_fingerpost = layer.kind.is_fingerpost
     res = [
         message.MessageElem(
-            number=marker_numbers[marker_uid],
-            infoplan=marker_infoplan(vars_by_side.get(marker_uid, {}), marker_uid, layer.kind.side_keys()),
+            number=snapshot.marker_number(marker_uid),
+            infoplan=marker_infoplan(snapshot.marker_vars_by_side(marker_uid), marker_uid, layer.kind.side_keys()),
             side_count=layer.kind.sides,
             layer_color=layout.color_adapter(layer.color.rgb_code),
-            fingerpost_data=fingerpost_data.get(marker_uid),
+            fingerpost_data=snapshot.fingerpost_data(marker_uid) if is_fingerpost else None,
         )
-        for marker_uid in marker_numbers.keys()
+        for marker_uid in snapshot.marker_positions(floor, layer).keys()
     ]
     return res
 
 
-def make_messages_obj_many_layers(floor: Page, layers: List[Layer]):
+def make_messages_obj_many_layers(snapshot: ProjectSnapshot, floor: Page, layers: List[Layer]):
     messages = list(itertools.chain.from_iterable(
-        make_messages_obj(floor, L)
+        make_messages_obj(snapshot, floor, L)
         for L in layers
     ))
     return messages
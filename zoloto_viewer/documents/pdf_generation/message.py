@@ -48,6 +48,12 @@ class MessageElem:
         self._infoplan_to_lines()
         self._calc_side_heights()
 
+    def __getstate__(self):
+        # canvas is not picklable, it's set again before drawing
+        state = self.__dict__.copy()
+        state.pop('canvas', None)
+        return state
+
     def draw(self, position):
         self.canvas.saveState()
         self._draw_bounds(position)
@@ -179,8 +185,7 @@ class MessageElem:
             self.side_heights[side] = 1.2 * sum(line_heights)
 
     def _number_width(self):
-        self.canvas.setFont(self.FONT_NAME, self.FONT_SIZE)
-        return self.canvas.stringWidth(self.number) + self.PADDING_LEFT + self.PADDING_RIGHT
+        return layout.string_width(self.number, self.FONT_NAME, self.FONT_SIZE) + self.PADDING_LEFT + self.PADDING_RIGHT
 
 
 class TextPictLine:
@@ -201,8 +206,7 @@ class TextPictLine:
     def get_width(self, canvas):
         w = 0
         for text, is_pict in self._source:
-            canvas.setFont(self._font_name(is_pict), self._font_size(is_pict))
-            w += canvas.stringWidth(text)
+            w += layout.string_width(text, self._font_name(is_pict), self._font_size(is_pict))
         return w
 
     def write_to_text(self, text_obj):
@@ -261,8 +265,15 @@ class MessagesAreaFreeBox:
         return self._padding_left + mess_width < self._width
 
     def error_message(self, canvas, message):
+        self.draw_error_message(canvas, self.error_message_position(), message)
+
+    def error_message_position(self):
+        return self._padding_left + self.padding_col(), self._row_top_bound
+
+    @staticmethod
+    def draw_error_message(canvas, position, message):
         canvas.setFont(MessageElem.FONT_NAME, MessageElem.FONT_SIZE)
-        canvas.drawString(self._padding_left + self.padding_col(), self._row_top_bound,
+        canvas.drawString(*position,
                           'Недостаточно места для отображения переменных. '
                           + f'Инфоплан {message.number} был пропущен.')
 
@@ -285,6 +296,8 @@ class MessagesAreaFreeBox:
         return left, bottom
 
     def new_row(self):
+        if not self._row_mess_heights:  # row is empty yet, nothing to move
+            return
         self._row_top_bound -= max(self._row_mess_heights) + self.padding_row()
         self._row_mess_heights.clear()
         self._padding_left = self.row_start()
@@ -302,6 +315,74 @@ class MessagesAreaFreeBox:
         return 0
 
 
+class MessagesAreaSkyline(MessagesAreaFreeBox):
+    """
+    Упаковка по линии горизонта (skyline): сообщение ставится туда, где оно окажется выше всего
+    (при равенстве - левее), поэтому низкие сообщения занимают место под соседями высоких.
+    Порядок сообщений не меняется, одинаковый вход даёт одинаковую раскладку.
+    """
+
+    def __init__(self, width, height):
+        super().__init__(width, height)
+        # segments [x_start, x_end, depth], depth is taken height measured down from the area top bound
+        self._skyline = [[self.row_start(), self._width, 0]]
+
+    def place_message(self, mess_width, mess_height):
+        best = None     # (depth, x_start)
+        for x_start, _, _ in self._skyline:
+            if not x_start + mess_width < self._width:
+                break
+            depth = self._span_depth(x_start, x_start + mess_width + self.padding_col())
+            if best is None or depth < best[0]:
+                best = (depth, x_start)
+
+        if best is None:
+            raise layout.TooLargeMessageException
+        depth, left = best
+        if not self._row_top_bound - depth > mess_height:
+            raise layout.NotEnoughSpaceException
+
+        self._raise_span(left, left + mess_width + self.padding_col(), depth + mess_height + self.padding_row())
+        return left, self._row_top_bound - depth - mess_height
+
+    def error_message_position(self):
+        max_depth = max(depth for _, _, depth in self._skyline)
+        return self.row_start() + self.padding_col(), self._row_top_bound - max_depth
+
+    def _span_depth(self, x_start, x_end):
+        return max(depth for s_start, s_end, depth in self._skyline if s_start < x_end and s_end > x_start)
+
+    def _raise_span(self, x_start, x_end, new_depth):
+        x_end = min(x_end, self._width)
+        updated = []
+        inserted = False
+        for s_start, s_end, depth in self._skyline:
+            if s_end <= x_start or s_start >= x_end:
+                updated.append([s_start, s_end, depth])
+                continue
+            if s_start < x_start:
+                updated.append([s_start, x_start, depth])
+            if not inserted:
+                updated.append([x_start, x_end, new_depth])
+                inserted = True
+            if s_end > x_end:
+                updated.append([x_end, s_end, depth])
+
+        merged = []
+        for segment in updated:
+            if merged and merged[-1][2] == segment[2] and merged[-1][1] == segment[0]:
+                merged[-1][1] = segment[1]
+            else:
+                merged.append(segment)
+        self._skyline = merged
+
+
+PACKING_STRATEGIES = {
+    'rows': MessagesAreaFreeBox,
+    'skyline': MessagesAreaSkyline,
+}
+
+
 def replace_tabs(line: str):
     picts_collapsed = re.sub(r'<span[A-z=_" ]*>(.+?)</span>', 'P', line)
     while '\t' in picts_collapsed:
@@ -1,22 +1,48 @@
+import collections
+
+from dataclasses import dataclass
+from typing import List, Tuple
+
 from . import layout
-from .message import MessagesAreaFreeBox, MessageElem
+from .message import MessagesAreaFreeBox, MessageElem, PACKING_STRATEGIES
+
+
+@dataclass
+class MessagePlacement:
+    message: MessageElem
+    position: Tuple[float, float]     # canvas coordinates
+    is_skipped: bool = False          # too large, error text drawn at position instead
 
 
 class MessagePageWriter(layout.BasePageWriterDeducingTitle):
-    def __init__(self, canvas, floor, layers, marker_messages_getter):
+    def __init__(self, canvas, floor, layers, marker_messages_getter, packing='rows'):
+        """
+        :param packing: key of message.PACKING_STRATEGIES, 'rows' or 'skyline'
+        """
         self.floor = floor
         self.layers = layers
+        self.area_cls = PACKING_STRATEGIES[packing]
         self._marker_messages = marker_messages_getter(floor, layers)
+        self._pages = None
+        self._page_placements = []
         super().__init__(canvas)
 
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    @property
+    def pages(self) -> List[List[MessagePlacement]]:
+        if self._pages is None:
+            self._pages = self.paginate()
+        return self._pages
+
     def write(self):
-        self.draw_header()
-        self.draw_footer()
-        try:
-            self.draw_content()
-        except layout.NotEnoughSpaceException:
-            self.canvas.showPage()
-            self.write()
+        for n, page in enumerate(self.pages):
+            if n:
+                self.canvas.showPage()
+            self._page_placements = page
+            super().write()
 
     def make_page_title(self):
         title = [
@@ -30,20 +56,47 @@ class MessagePageWriter(layout.BasePageWriterDeducingTitle):
         return super_title
 
     def draw_content(self):
+        for placement in self._page_placements:     # type: MessagePlacement
+            if placement.is_skipped:
+                MessagesAreaFreeBox.draw_error_message(self.canvas, placement.position, placement.message)
+                continue
+            placement.message.set_canvas(self.canvas)
+            placement.message.draw(placement.position)
+
+    def paginate(self) -> List[List[MessagePlacement]]:
+        """
+        Раскладка сообщений по страницам без рисования (canvas нужен только для метрик шрифтов),
+        результат можно передать в use_prepared_pages писателя на другом canvas
+        """
         area_width, area_height = layout.mess_area_size()
         area_left, area_bottom = layout.mess_area_position()
-        area = MessagesAreaFreeBox(area_width, area_height)
+        area = self.area_cls(area_width, area_height)
+        pages = [[]]
 
-        while self._marker_messages:
-            message: MessageElem = self._marker_messages.pop(0)
+        # размеры всех сообщений считаются один раз, до раскладки
+        queue = collections.deque()
+        for message in self._marker_messages:   # type: MessageElem
             message.set_canvas(self.canvas)
+            queue.append((message, message.get_width(), message.get_height()))
+
+        while queue:
+            message, width, height = queue.popleft()
             try:
-                offset_left, offset_bottom = area.place_message(message.get_width(), message.get_height())
+                offset_left, offset_bottom = area.place_message(width, height)
             except layout.TooLargeMessageException:
-                area.error_message(self.canvas, message)
+                pages[-1].append(MessagePlacement(message, area.error_message_position(), is_skipped=True))
                 continue
             except layout.NotEnoughSpaceException:
-                self._marker_messages.insert(0, message)
-                raise
+                if not pages[-1]:   # does not fit even an empty page
+                    pages[-1].append(MessagePlacement(message, area.error_message_position(), is_skipped=True))
+                    continue
+                area = self.area_cls(area_width, area_height)
+                pages.append([])
+                queue.appendleft((message, width, height))
+                continue
             box_offset = area_left + offset_left, area_bottom + offset_bottom
-            message.draw(box_offset)
+            pages[-1].append(MessagePlacement(message, box_offset))
+        return pages
+
+    def use_prepared_pages(self, pages: List[List[MessagePlacement]]):
+        self._pages = pages
@@ -1,12 +1,16 @@
+import collections
+import itertools
 import logging
 import math
+import numpy as np
+import time
 
 from abc import abstractmethod, ABC
-from dataclasses import dataclass, field
+from dataclasses import InitVar, dataclass, field
 from reportlab.lib import colors
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas as rc
-from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from zoloto_viewer.viewer.models import Layer
 from zoloto_viewer.infoplan.models import CaptionPlacement
@@ -19,13 +23,17 @@ logger = logging.getLogger(__name__)
 class PlanBox:
     DECLARED_PLAN_ASPECT = 365 / 227
 
-    def __init__(self, image_pil, image_size, indd_bounds):
-        self._img = ImageReader(image_pil)
+    def __init__(self, image_loader: Callable[[], Any], image_size, indd_bounds):
+        # подложка загружается только при рисовании, для расчёта раскладки достаточно размеров
+        self._image_loader = image_loader
+        self._img = None
+        self.image_load_time = 0.     # seconds spent loading, decoding and embedding the plan, 0 if not drawn
         self._img_width, self._img_height = image_size
         self._indd_bounds = indd_bounds
 
         self._box_width, self._box_height = layout.work_area_size()
         self._box_x, self._box_y = layout.plan_area_position()
+        self._is_fitted = False
 
     @property
     def canvas_left(self):
@@ -86,24 +94,49 @@ class PlanBox:
         factor = self._box_height / (gb_bottom - gb_top)
         return (factor * point[0], factor * point[1])
 
-    def draw_plan_image(self, canvas: rc.Canvas, **options):
+    def fit_to_image(self):
         # ведущее направеление считаем так: берём отношение ширина/высота
         # если оно больше или равно заданному тогда горизонталь ведущее направление, в противном случае вертикаль
         # если это горизонталь, обновляем self._box_height
         # если вертикаль, то нужно пересчитать ширину и сдвиг слева
+        if self._is_fitted:
+            return
         actual_aspect = self._img_width / self._img_height
         if actual_aspect >= PlanBox.DECLARED_PLAN_ASPECT:
             self._box_height = self._box_width / actual_aspect
-            canvas.drawImage(self._img, x=self._box_x, y=self._box_y,
-                             width=self._box_width,
-                             preserveAspectRatio=True, anchor='sw')
         else:
             new_width = self._box_height * actual_aspect
             self._box_x += (self._box_width - new_width) / 2
             self._box_width = new_width
+        self._is_fitted = True
+
+    def draw_plan_image(self, canvas: rc.Canvas, form_name: Optional[str] = None, **options):
+        """
+        :param form_name: если задано, подложка встраивается в документ один раз как form xobject с таким именем,
+         следующие страницы того же этажа только ссылаются на неё
+        """
+        self.fit_to_image()
+        if form_name is None:
+            self._draw_image(canvas)
+        else:
+            layout.draw_as_form(canvas, form_name, lambda: self._draw_image(canvas))
+
+    def _draw_image(self, canvas: rc.Canvas):
+        # drawImage decodes and embeds the image, so its time is counted too
+        started = time.monotonic()
+        if self._img is None:
+            self._img = ImageReader(self._image_loader())
+
+        actual_aspect = self._img_width / self._img_height
+        if actual_aspect >= PlanBox.DECLARED_PLAN_ASPECT:
+            canvas.drawImage(self._img, x=self._box_x, y=self._box_y,
+                             width=self._box_width,
+                             preserveAspectRatio=True, anchor='sw')
+        else:
             canvas.drawImage(self._img, x=self._box_x, y=self._box_y,
                              height=self._box_height,
                              preserveAspectRatio=True, anchor='sw')
+        self.image_load_time += time.monotonic() - started
 
 
 class PlanLegend:
@@ -115,7 +148,20 @@ class PlanLegend:
         self.legend_inter = 4 * scale_factor
         self.desc_padding_left = 3 * scale_factor
 
-    def draw(self, canvas, box, layers):
+    def form_name(self, layers):
+        """Legend of the same layers is the same on every page"""
+        return layout.form_name_digest(
+            'legend', self.x, self.y, self.font_size,
+            [(L.id, L.title, L.desc, L.color.rgb_code, L.kind.unicode_symbol, L.kind.is_fingerpost) for L in layers],
+        )
+
+    def draw(self, canvas, box, layers, form_name: Optional[str] = None):
+        if form_name is None:
+            self._draw(canvas, box, layers)
+        else:
+            layout.draw_as_form(canvas, form_name, lambda: self._draw(canvas, box, layers))
+
+    def _draw(self, canvas, box, layers):
         text_font_size = self.font_size
         x_mark = self.x
         x_text = x_mark + self.desc_padding_left
@@ -160,10 +206,12 @@ class Object:
     uid: Any
 
     fingerpost_meta: dict
-    layer: Layer
+    # only ids and values of the layer are kept, objects are pickled into the floor layout cache
+    layer: InitVar[Layer]
     layer_id: int = field(init=False)
     layer_color: dict = field(init=False)
     layer_kind: int = field(init=False)
+    layer_symbol: str = field(init=False)
     is_fingerpost: bool = field(init=False)
 
     marker: Any = field(default=None, init=False)
@@ -179,16 +227,17 @@ class Object:
     def __hash__(self):
         return hash((self.x, self.y, self.a, self.number))
 
-    def __post_init__(self):
+    def __post_init__(self, layer: Layer):
         while self.a < 0:
             self.a += 360
         while self.a >= 360:
             self.a -= 360
 
-        l = self.layer
+        l = layer
         self.layer_id = l.id
         self.layer_color = layout.color_adapter(l.color.rgb_code)
         self.layer_kind = l.kind.id
+        self.layer_symbol = l.kind.unicode_symbol
         self.is_fingerpost = l.kind.is_fingerpost
 
     def __repr__(self):
@@ -212,7 +261,7 @@ class Object:
         #     5: '\uE900',
         # }
         # symbol = MARKS[self.layer_kind]
-        symbol = self.layer.kind.unicode_symbol
+        symbol = self.layer_symbol
         return symbol
 
     @property
@@ -241,9 +290,8 @@ class Object:
         # а canvas отдаёт абсолютные размеры длины и высоты строки,
         # поэтому растяжение должно быть применено на этом шаге
         font, size = self._font_options(font_size)
-        canvas.setFont(font, size)
         str_width_fix = 8
-        width = canvas.stringWidth(self._symbol) - str_width_fix
+        width = layout.string_width(self._symbol, font, size) - str_width_fix
         height = width
 
         # center coordinates
@@ -260,9 +308,8 @@ class Object:
         x, y = box.calc_pos(self.center)
 
         font, size = self._font_options(font_size)
-        canvas.setFont(font, size)
         str_width_fix = 8
-        width = canvas.stringWidth(self._symbol) - str_width_fix
+        width = layout.string_width(self._symbol, font, size) - str_width_fix
         r = width // 2
         return BoundingCircle(x, y, r, ref=self)
 
@@ -326,6 +373,30 @@ class Object:
                 pane_symbol = self.fingerpost_symbols[pane_key]
                 canvas.drawCentredString(x, y, pane_symbol)
 
+    def _glyphs(self):
+        """Symbol and enabled fingerpost panes, drawn one over another in that order"""
+        glyphs = [self._symbol]
+        if self.is_fingerpost:
+            glyphs.extend(
+                self.fingerpost_symbols[pane_key]
+                for pane_key, is_enabled in self.fingerpost_meta.items()
+                if is_enabled
+            )
+        return glyphs
+
+    def write_glyphs(self, text, x, y, font, size):
+        """
+        Same as translate(x, y), rotate(a), drawCentredString(0, -size / 2) for every glyph,
+        but with text matrix of reportlab text object instead of canvas transformations
+        """
+        rad = math.radians(self.a)
+        cos, sin = math.cos(rad), math.sin(rad)
+        dy = - size / 2
+        for glyph in self._glyphs():
+            dx = - layout.string_width(glyph, font, size) / 2
+            text.setTextTransform(cos, sin, -sin, cos, x + cos * dx - sin * dy, y + sin * dx + cos * dy)
+            text.textOut(glyph)
+
     def get_caption_offset(self, increase_a=None, cross_delta=None):
         a_ = self.a
         if increase_a:
@@ -339,6 +410,32 @@ class Object:
         return offset, need_rotate
 
 
+def draw_objects(canvas, box, objects: List[Object], font_size=None, **options):
+    """
+    Рисует маркеры как Object.draw, но символы подряд идущих маркеров одного слоя
+    выводятся одним текстовым объектом: цвет и шрифт задаются один раз на слой,
+    поворот каждого маркера - матрицей текста, без saveState/translate/rotate/restoreState на каждый маркер.
+    Порядок рисования (и наложения) маркеров сохраняется
+    """
+    marker_size_factor = options.get('marker_size_factor', 100)
+    font, size = layout.Definitions.MARK_FONT_NAME, font_size or layout.Definitions.MARK_FONT_SIZE
+    size *= marker_size_factor / 100
+    alpha = options.get('objects_opacity', 100) / 100
+
+    for _, layer_objects in itertools.groupby(objects, key=lambda o: o.layer_id):
+        layer_objects = list(layer_objects)
+        canvas.saveState()
+        layout.set_colors(canvas, layer_objects[0].layer_color, alpha=alpha)
+        text = canvas.beginText()
+        text.setFont(font, size)
+        for obj in layer_objects:
+            obj.get_bounding_box(canvas, box)  # for attr cache
+            x, y = box.calc_pos(obj.center)
+            obj.write_glyphs(text, x, y, font, size)
+        canvas.drawText(text)
+        canvas.restoreState()
+
+
 @dataclass
 class MarkerCaption:
     CAPTION_FONT_NAME = 'Helvetica'
@@ -415,8 +512,7 @@ class MarkerCaption:
         if self.need_rotate:
             return self._get_bounding_box_rotate(canvas, self.offset)
 
-        canvas.setFont(self.CAPTION_FONT_NAME, self.CAPTION_FONT_SIZE)
-        width = canvas.stringWidth(self.number)
+        width = layout.string_width(self.number, self.CAPTION_FONT_NAME, self.CAPTION_FONT_SIZE)
         height = self.CAPTION_FONT_SIZE
 
         offset_x, offset_y = self.offset
@@ -437,11 +533,40 @@ class MarkerCaption:
         self.rotation = 0
         return self.bounding_box
 
+    def candidate_rects(self, tuning_options) -> Tuple[np.ndarray, List[Tuple[Any, bool]]]:
+        """
+        Прямоугольники (x, y, w, h) подписи для вариантов (increase_a, cross_delta) одним массивом,
+        те же, что дал бы get_bounding_box после set_box_params, но без BoundingBox на каждый вариант.
+        Ширина текста измеряется один раз. Вторым значением (offset, need_rotate) каждого варианта
+        """
+        text_width = layout.string_width(self.number, self.CAPTION_FONT_NAME, self.CAPTION_FONT_SIZE)
+        text_height = self.CAPTION_FONT_SIZE
+        obj_xc = self.obj.bounding_box.x + self.obj.bounding_box.w // 2
+        obj_yc = self.obj.bounding_box.y + self.obj.bounding_box.h // 2
+
+        rects = np.empty((len(tuning_options), 4))
+        params = []
+        for n, (increase_a, cross_delta) in enumerate(tuning_options):
+            offset, need_rotate = self.obj.get_caption_offset(increase_a=increase_a, cross_delta=cross_delta)
+            offset_x, offset_y = offset
+            if need_rotate:     # see _get_bounding_box_rotate
+                width, height = text_height, text_width
+                if offset_y < 0:
+                    offset_y -= height
+                offset_x += width // 2
+            else:
+                width, height = text_width, text_height
+                if offset_x < 0:
+                    offset_x -= width
+                offset_y -= height // 2
+            rects[n] = obj_xc + offset_x, obj_yc + offset_y, width, height
+            params.append((offset, need_rotate))
+        return rects, params
+
     def _get_bounding_box_rotate(self, canvas, offset) -> 'BoundingBox':
         offset_x, offset_y = offset
 
-        canvas.setFont(self.CAPTION_FONT_NAME, self.CAPTION_FONT_SIZE)
-        height = canvas.stringWidth(self.number)
+        height = layout.string_width(self.number, self.CAPTION_FONT_NAME, self.CAPTION_FONT_SIZE)
         width = self.CAPTION_FONT_SIZE
 
         # text length
@@ -466,6 +591,11 @@ class Bounds(ABC):
     def intersect(self, other: 'Bounds'):
         pass
 
+    @abstractmethod
+    def extent(self, margins=0) -> Tuple[float, float, float, float]:
+        """Охватывающий прямоугольник (x_min, y_min, x_max, y_max) с учётом отступов"""
+        pass
+
 
 @dataclass(frozen=True)
 class BoundingCircle(Bounds):
@@ -481,6 +611,10 @@ class BoundingCircle(Bounds):
     def intersect(self, other: 'Bounds'):
         return False    # no matter for now
 
+    def extent(self, margins=0):
+        rad_margins = self.r + margins
+        return self.cx - rad_margins, self.cy - rad_margins, self.cx + rad_margins, self.cy + rad_margins
+
 
 @dataclass
 class BoundingBox(Bounds):
@@ -491,6 +625,9 @@ class BoundingBox(Bounds):
 
     ref: Union[Object, MarkerCaption]
 
+    # отступы, добавляемые к другой границе при проверке пересечения
+    MARGINS = 5
+
     def __repr__(self):
         return f'BB[{self.x:.0f}:{self.x + self.w:.0f}],[{self.y:.0f}:{self.y + self.h:.0f}]/{self.ref.number}'
 
@@ -502,13 +639,16 @@ class BoundingBox(Bounds):
         else:
             return False    # ignore unknown shapes
 
+    def extent(self, margins=0):
+        return self.x - margins, self.y - margins, self.x + self.w + margins, self.y + self.h + margins
+
     def ignore_intersectins(self, other: 'BoundingBox'):
         # todo log intersections
         return False
 
     def _intersect_box(self, other: 'BoundingBox'):
         # add 5px margins to other
-        margins = 5
+        margins = self.MARGINS
 
         s_x_min, s_x_max = self.x, self.x + self.w
         o_x_min, o_x_max = other.x - margins, other.x + other.w + margins
@@ -526,7 +666,7 @@ class BoundingBox(Bounds):
 
     def _intersect_circle(self, other: 'BoundingCircle'):
         # add 5px margins to other
-        margins = 5
+        margins = self.MARGINS
         rad_margins = other.r + margins
 
         s_x_min, s_x_max = self.x, self.x + self.w
@@ -544,6 +684,53 @@ class BoundingBox(Bounds):
         return is_intersect
 
 
+class UniformGrid:
+    """
+    Равномерная сетка для поиска соседей: каждый ключ регистрируется во всех ячейках,
+    которые покрывает его охватывающий прямоугольник. Запрос возвращает надмножество
+    пересекающихся ключей, точную проверку выполняет вызывающий код
+    """
+    CELL_SIZE = 2 * MarkerCaption.USUAL_WIDTH
+
+    def __init__(self, cell_size=None):
+        self._cell_size = cell_size or self.CELL_SIZE
+        self._cells: Dict[Tuple[int, int], Set[int]] = collections.defaultdict(set)
+        self._key_cells: Dict[int, List[Tuple[int, int]]] = {}
+
+    def __len__(self):
+        return len(self._key_cells)
+
+    def _cells_covering(self, extent) -> List[Tuple[int, int]]:
+        x_min, y_min, x_max, y_max = extent
+        size = self._cell_size
+        return [
+            (i, j)
+            for i in range(math.floor(x_min / size), math.floor(x_max / size) + 1)
+            for j in range(math.floor(y_min / size), math.floor(y_max / size) + 1)
+        ]
+
+    def insert(self, key: int, extent):
+        cells = self._cells_covering(extent)
+        for cell in cells:
+            self._cells[cell].add(key)
+        self._key_cells[key] = cells
+
+    def remove(self, key: int):
+        for cell in self._key_cells.pop(key, []):
+            bucket = self._cells[cell]
+            bucket.discard(key)
+            if not bucket:
+                del self._cells[cell]
+
+    def query(self, extent) -> Set[int]:
+        found = set()
+        for cell in self._cells_covering(extent):
+            bucket = self._cells.get(cell)
+            if bucket:
+                found |= bucket
+        return found
+
+
 class BoundsIndex:
     def __init__(self, canvas, plan_box, objects):
         self._objects = [
@@ -552,6 +739,17 @@ class BoundsIndex:
         ]
         self._markers = []
 
+        # ключи сетки: сначала объекты, затем подписи в порядке добавления,
+        # поэтому сортировка ключей повторяет порядок обхода __iter__
+        self._grid = UniformGrid()
+        self._bounds_by_key: Dict[int, Bounds] = {}
+        self._extents = np.empty((max(2 * len(self._objects), 16), 4))    # row per key, with margins
+        self._object_keys: Dict[int, int] = {}                              # id(Object) -> key
+        self._markers_keys: List[int] = []
+        self._next_key = 0
+        for obj_bc in self._objects:
+            self._object_keys[id(obj_bc.ref)] = self._grid_insert(obj_bc)
+
     def __iter__(self) -> Bounds:
         for obj__bb in self._objects:
             yield obj__bb
@@ -574,6 +772,17 @@ class BoundsIndex:
 
     def cancel_last_marker(self):
         self._markers.pop()
+        self._grid_remove(self._markers_keys.pop())
+
+    def remove_marker(self, place: Bounds):
+        i = next(i for i, m in enumerate(self._markers) if m is place)
+        del self._markers[i]
+        self._grid_remove(self._markers_keys.pop(i))
+
+    def neighbours(self, box: Bounds) -> List[Bounds]:
+        """Границы из ячеек сетки, которые задевает box, в порядке обхода индекса"""
+        keys = self._grid.query(box.extent())
+        return [self._bounds_by_key[k] for k in sorted(keys)]
 
     def collisions(self, box: BoundingBox):
         def own_obj(bb):
@@ -582,7 +791,7 @@ class BoundsIndex:
             return box_is_caption and bb_is_object and box.ref.obj == bb.ref
 
         buf = []
-        for bb in self:     # type: Bounds
+        for bb in self.neighbours(box):     # type: Bounds
             if box.intersect(bb):
                 # marker of object may be close
                 if not own_obj(bb):
@@ -604,7 +813,7 @@ class BoundsIndex:
             return box_is_caption and bb_is_object and box.ref.obj == bb.ref
 
         count = 0
-        for bb in self:     # type: Bounds
+        for bb in self.neighbours(box):     # type: Bounds
             if box.intersect(bb):
                 # marker of object may be close
                 if not own_obj(bb):
@@ -613,6 +822,25 @@ class BoundsIndex:
                         return True
         return False
 
+    def collision_counts(self, rects: np.ndarray, own_obj: Optional[Object] = None) -> np.ndarray:
+        """
+        Для каждого прямоугольника (x, y, w, h) число пересечений с границами индекса, как в is_collide,
+        за один запрос к сетке. Граница own_obj (объект, чья это подпись) не считается
+        """
+        x_min, y_min = rects[:, 0], rects[:, 1]
+        x_max, y_max = x_min + rects[:, 2], y_min + rects[:, 3]
+        keys = self._grid.query((x_min.min(), y_min.min(), x_max.max(), y_max.max()))
+        if own_obj is not None:
+            keys.discard(self._object_keys.get(id(own_obj)))
+        if not keys:
+            return np.zeros(len(rects), dtype=int)
+
+        # extents already include margins, same as BoundingBox.intersect adds to other bound
+        others = self._extents[list(keys)]
+        x_overlap = np.minimum(x_max[:, None], others[:, 2]) > np.maximum(x_min[:, None], others[:, 0])
+        y_overlap = np.minimum(y_max[:, None], others[:, 3]) > np.maximum(y_min[:, None], others[:, 1])
+        return (x_overlap & y_overlap).sum(axis=1)
+
     def is_object_placed(self, obj: Object):
         for m in self._markers:
             if m.ref == obj:
@@ -625,6 +853,23 @@ class BoundsIndex:
 
     def write(self, place: Bounds):
         self._markers.append(place)
+        self._markers_keys.append(self._grid_insert(place))
+
+    def _grid_insert(self, bounds: Bounds) -> int:
+        key = self._next_key
+        self._next_key += 1
+        self._bounds_by_key[key] = bounds
+        # в сетку кладём границу с отступами, которые BoundingBox.intersect добавляет к другой границе
+        extent = bounds.extent(margins=BoundingBox.MARGINS)
+        if key == len(self._extents):
+            self._extents = np.concatenate([self._extents, np.empty_like(self._extents)])
+        self._extents[key] = extent
+        self._grid.insert(key, extent)
+        return key
+
+    def _grid_remove(self, key: int):
+        self._grid.remove(key)
+        del self._bounds_by_key[key]
 
 
 def is_objects_one_cluster(obj1: BoundingCircle, obj2: BoundingCircle) -> bool:
@@ -670,59 +915,84 @@ class ObjectBoundsBucket:
 
 
 class ObjectsConfiguration:
-    def __init__(self, object_circles: List[BoundingCircle]):
+    """
+    Взаимное расположение объектов этажа: ранг плотности и упорядоченные по расстоянию соседи.
+    Расстояния считаются в numpy блоками строк матрицы, при большом числе объектов
+    (или явно заданном max_neighbours) для каждого объекта хранятся только ближайшие соседи
+    """
+    FULL_MATRIX_MAX_OBJECTS = 1500
+    BOUNDED_CHUNK_ROWS = 256
+    BOUNDED_NEIGHBOURS_COUNT = 32
+
+    def __init__(self, object_circles: List[BoundingCircle], max_neighbours: Optional[int] = None):
         self._obj_circles: List[BoundingCircle] = object_circles
         self._obj_index: List[Object] = [obj.ref for obj in self._obj_circles]
-        self._distance_list: List[Tuple[int, int, float]] = self._calc_distances_list()
-
-        self.neighbours_index: Dict[Object, List[Tuple[Object, float]]] = self._make_neighbours_index()
-        self.density_rank: List[Object] = self._make_density_rank()
+        self._obj_positions: Dict[Object, int] = {obj: i for i, obj in enumerate(self._obj_index)}
+        self._centers = np.array([(bc.cx, bc.cy) for bc in self._obj_circles], dtype=float).reshape(-1, 2)
 
-    def neighbours_gen(self, obj: Object) -> Tuple[Object, float]:
-        for neighbour, distance in self.neighbours_index[obj]:
-            yield neighbour, distance
+        objects_count = len(self._obj_circles)
+        is_bounded = max_neighbours is not None or objects_count > self.FULL_MATRIX_MAX_OBJECTS
+        if is_bounded and max_neighbours is None:
+            max_neighbours = self.BOUNDED_NEIGHBOURS_COUNT
+        self._neighbours_count = max(objects_count - 1, 0)
+        if is_bounded:
+            self._neighbours_count = min(max(max_neighbours, 1), self._neighbours_count)
+        self._chunk_rows = self.BOUNDED_CHUNK_ROWS if is_bounded else max(objects_count, 1)
 
-    def _calc_distances_list(self) -> List[Tuple[int, int, float]]:
-        return [
-            (i, j, get_objects_distance(obj1, obj2) )
-            for i, obj1 in enumerate(self._obj_circles)
-            for j, obj2 in enumerate(self._obj_circles)
-            if obj2 != obj1
-        ]
-
-    def _make_density_rank(self) -> List[Object]:
-        def density(selected: int) -> float:
-            if self._distance_list:
-                return 1. / sum(d for i, j, d in self._distance_list if i == selected)
-            else:
-                return 1.
-
-        def tuple_to_density(index_obj_tuple):
-            return density(index_obj_tuple[0])
-
-        return [
-            obj
-            for i, obj in sorted(
-                enumerate(self._obj_index), key=tuple_to_density, reverse=True
-            )
-        ]
-
-    def _make_neighbours_index(self) -> Dict[Object, List[Tuple[Object, float]]]:
-        def neighbours(selected: int) -> List[Tuple[Object, float]]:
-            # итерируемся по списку обращая внимание только на кортежи где на первом месте selected
-            def by_distance(ind_distance_tuple): return ind_distance_tuple[0]
-
-            slice = [(j, d) for i, j, d in self._distance_list if i == selected]
-            return [
-                (self._obj_index[j], d)
-                for j, d in sorted(slice, key=by_distance)
-            ]
+        distance_sums = self._calc_distances()
+        self.density_rank: List[Object] = self._make_density_rank(distance_sums)
 
+    @property
+    def neighbours_index(self) -> Dict[Object, List[Tuple[Object, float]]]:
         return {
-            obj1: neighbours(i)
-            for i, obj1 in enumerate(self._obj_index)
+            obj: list(self.neighbours_gen(obj))
+            for obj in self._obj_index
         }
 
+    def neighbours_gen(self, obj: Object) -> Tuple[Object, float]:
+        i = self._obj_positions[obj]
+        for j, distance in zip(self._neighbour_ids[i], self._neighbour_distances[i]):
+            yield self._obj_index[j], float(distance)
+
+    def _calc_distances(self) -> np.ndarray:
+        """
+        Заполняет индексы и расстояния ближайших соседей (по возрастанию расстояния,
+        при равенстве по порядку объектов), возвращает суммы расстояний до всех объектов
+        """
+        objects_count = len(self._centers)
+        k = self._neighbours_count
+        distance_sums = np.zeros(objects_count)
+        self._neighbour_ids = np.empty((objects_count, k), dtype=np.int32)
+        self._neighbour_distances = np.empty((objects_count, k))
+
+        for row_start in range(0, objects_count, self._chunk_rows):
+            rows = slice(row_start, min(row_start + self._chunk_rows, objects_count))
+            deltas = self._centers[rows, np.newaxis, :] - self._centers[np.newaxis, :, :]
+            block = np.sqrt(np.einsum('ijk,ijk->ij', deltas, deltas))
+            distance_sums[rows] = block.sum(axis=1)
+
+            # исключаем сам объект из его соседей
+            rows_count = block.shape[0]
+            block[np.arange(rows_count), np.arange(row_start, row_start + rows_count)] = np.inf
+            if k == objects_count - 1:
+                candidates = np.broadcast_to(np.arange(objects_count), block.shape)
+            else:
+                # k ближайших в произвольном порядке, упорядочиваем по номеру объекта для устойчивости
+                candidates = np.sort(np.argpartition(block, k - 1, axis=1)[:, :k], axis=1)
+            candidate_distances = np.take_along_axis(block, candidates, axis=1)
+            order = np.argsort(candidate_distances, axis=1, kind='stable')[:, :k]
+            self._neighbour_ids[rows] = np.take_along_axis(candidates, order, axis=1)
+            self._neighbour_distances[rows] = np.take_along_axis(candidate_distances, order, axis=1)
+
+        return distance_sums
+
+    def _make_density_rank(self, distance_sums: np.ndarray) -> List[Object]:
+        # плотность обратна сумме расстояний, совпадающие объекты считаются самыми плотными
+        with np.errstate(divide='ignore'):
+            density = 1. / distance_sums
+        order = np.argsort(-density, kind='stable')
+        return [self._obj_index[i] for i in order]
+
 @dataclass
 class NearObjectsGroup:
     objects: List[Object]
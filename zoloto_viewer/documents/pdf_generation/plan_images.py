@@ -0,0 +1,70 @@
+import io
+import logging
+
+from os import path
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from typing import Optional
+
+from zoloto_viewer.viewer.models import Page
+
+from . import layout
+
+logger = logging.getLogger(__name__)
+
+POINTS_PER_INCH = 72
+
+
+def plan_image_for_pdf(floor: Page, dpi: Optional[int] = None, quality: Optional[int] = None) -> io.BytesIO:
+    """
+    Подложка этажа, уменьшенная до разрешения dpi в области плана на странице, в виде jpeg.
+    Результат сохраняется рядом с исходной подложкой и переиспользуется, пока подложка не заменена.
+    reportlab встраивает jpeg в pdf как есть, без повторного сжатия.
+
+    :param dpi: by default settings.PDF_PLAN_DPI
+    :param quality: jpeg quality, by default settings.PDF_PLAN_JPEG_QUALITY
+    """
+    if dpi is None:
+        dpi = settings.PDF_PLAN_DPI
+    if quality is None:
+        quality = settings.PDF_PLAN_JPEG_QUALITY
+
+    storage = floor.plan.storage
+    derived_name = derived_plan_name(floor.plan.name, dpi, quality)
+    if storage.exists(derived_name):
+        with storage.open(derived_name) as f:
+            return io.BytesIO(f.read())
+
+    with floor.plan.open() as f:
+        orig_bytes = f.read()
+    pil_image = Image.open(io.BytesIO(orig_bytes))
+    target_size = target_pixel_size(pil_image.size, dpi)
+    if target_size == pil_image.size and pil_image.format == 'JPEG':
+        # подложка уже не больше нужного, повторное сжатие только ухудшит её
+        return io.BytesIO(orig_bytes)
+
+    logger.debug(f'resample plan {floor.plan.name} {pil_image.size} -> {target_size}')
+    resampled = pil_image.convert('RGB').resize(target_size, Image.LANCZOS)
+    buf = io.BytesIO()
+    resampled.save(buf, 'JPEG', optimize=True, quality=quality)
+    storage.save(derived_name, ContentFile(buf.getvalue()))
+    buf.seek(0)
+    return buf
+
+
+def derived_plan_name(plan_name, dpi, quality):
+    # имена подложек уникальны (file_overwrite = False), поэтому замена подложки даёт новый ключ
+    plan_dir, plan_file = path.split(plan_name)
+    stem, _ = path.splitext(plan_file)
+    return path.join(plan_dir, 'pdf', f'{stem}_{dpi}dpi_q{quality}.jpg')
+
+
+def target_pixel_size(image_size, dpi):
+    """Size of image fitted to plan area at dpi, never bigger than image itself"""
+    img_width, img_height = image_size
+    box_width, box_height = layout.work_area_size()
+    scale = min(box_width / img_width, box_height / img_height) * dpi / POINTS_PER_INCH
+    if scale >= 1:
+        return image_size
+    return max(1, round(img_width * scale)), max(1, round(img_height * scale))
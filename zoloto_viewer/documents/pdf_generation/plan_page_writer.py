@@ -1,11 +1,11 @@
 import logging
 
-from typing import List
+from typing import List, Optional, Tuple
 
 from zoloto_viewer.viewer.models import Layer, Page
 
-from . import layout
-from .plan import PlanBox, PlanLegend, Object
+from . import layout, plan_images
+from .plan import PlanBox, PlanLegend, Object, draw_objects
 
 logger = logging.getLogger(__name__)
 
@@ -13,18 +13,36 @@ logger = logging.getLogger(__name__)
 class PlanPageWriterMinimal(layout.BasePageWriterDeducingTitle):
     _content_box = None
 
-    def __init__(self, canvas, floor: Page, layers: List[Layer], marker_positions_getter):
+    def __init__(self, canvas, floor: Page, layers: List[Layer], marker_positions_getter,
+                 plan_size: Optional[Tuple[int, int]] = None):
+        """:param plan_size: (width, height) of the plan image if known, otherwise it is read from floor.plan"""
+        if plan_size is None:
+            plan_size = floor.plan.width, floor.plan.height
+        width, height = plan_size
         self.floor = floor
         self.layers = layers
         self._marker_positions = marker_positions_getter(floor, layers)
         self.draw_options = {
             'marker_size_factor': floor.marker_size_factor,
         }
-        self._content_box = PlanBox(self.floor.plan_pil_obj,
-                                    (self.floor.plan.width, self.floor.plan.height),
-                                    self.floor.geometric_bounds)
+        # same as Page.geometric_bounds
+        self._content_box = PlanBox(lambda: plan_images.plan_image_for_pdf(self.floor),
+                                    plan_size, [0, 0, height, width])
         super().__init__(canvas)
 
+    @property
+    def marker_objects(self) -> List[Object]:
+        return self._marker_positions
+
+    @property
+    def plan_image_load_time(self) -> float:
+        """0 unless the page is the first one drawing the floor plan"""
+        return self._content_box.image_load_time
+
+    def plan_form_name(self):
+        # все страницы этажа (без подписей, по группам слоёв) используют одну встроенную подложку
+        return f'plan_{self.floor.uid.hex}'
+
     @classmethod
     def place_legend(cls):
         x, y = layout.plan_area_position_left_top()
@@ -33,7 +51,7 @@ class PlanPageWriterMinimal(layout.BasePageWriterDeducingTitle):
         return x, y
 
     def draw_content(self):
-        self._content_box.draw_plan_image(self.canvas, **self.draw_options)
+        self._content_box.draw_plan_image(self.canvas, form_name=self.plan_form_name(), **self.draw_options)
         self._draw_markers(self._marker_positions)
         self._draw_legend(self.layers)
 
@@ -48,11 +66,9 @@ class PlanPageWriterMinimal(layout.BasePageWriterDeducingTitle):
         super_title = [self.floor.project.title, self.floor.project.stage]
         return super_title
 
-    def _draw_markers(self, objects):
-        options = self.draw_options
-        for mo in objects:   # type: Object
-            mo.draw(self.canvas, self._content_box, **options)
+    def _draw_markers(self, objects: List[Object]):
+        draw_objects(self.canvas, self._content_box, objects, **self.draw_options)
 
     def _draw_legend(self, layers):
         legend = PlanLegend(self.place_legend(), layout.Definitions.BOTTOM_LINE, len(layers))
-        legend.draw(self.canvas, self._content_box, layers)
+        legend.draw(self.canvas, self._content_box, layers, form_name=legend.form_name(layers))
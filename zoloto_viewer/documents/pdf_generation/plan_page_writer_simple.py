@@ -1,51 +1,65 @@
 import logging
 
 from reportlab.lib import colors
-from typing import Iterator, List
+from typing import Any, Dict, List, Optional, Tuple
 
 from zoloto_viewer.viewer.models import Layer, LayerGroup, Page
 from zoloto_viewer.infoplan.models import CaptionPlacement
 
 from . import layout
-from .plan import BoundingBox, BoundsIndex, MarkerCaption, Object
+from .caption_placement import CaptionPlacementEngine, PlacementMetrics
+from .plan import BoundsIndex, MarkerCaption, Object
 from .plan_page_writer import PlanPageWriterMinimal
 
 logger = logging.getLogger(__name__)
 
+# marker uid, offset, need_rotate: result of caption placement without ORM objects, see prepare_captions
+CaptionPlace = Tuple[Any, Tuple[float, float], bool]
+
 
 class PlanPageWriterLayerGroupsSimple(PlanPageWriterMinimal):
     def __init__(self, canvas,
                  floor: Page, layers: List[Layer], layers_group: LayerGroup,
-                 marker_positions_getter):
+                 marker_positions_getter, caption_placements: Dict[Any, dict],
+                 captions_db_buffer: Optional[List[CaptionPlacement]] = None,
+                 caption_time_budget: Optional[float] = None,
+                 plan_size: Optional[Tuple[int, int]] = None):
+        """
+        :param caption_placements: marker uid -> CaptionPlacement.data of that layers_group
+        :param captions_db_buffer: if passed new placements are appended there instead of saving,
+         caller is responsible to store them
+        :param caption_time_budget: seconds to improve captions placement after greedy pass,
+         see CaptionPlacementEngine, None means no limit
+        :param plan_size: see PlanPageWriterMinimal
+        """
         logger.debug('start PlanPageWriterMinimal')
-        super().__init__(canvas, floor, layers, marker_positions_getter)
+        super().__init__(canvas, floor, layers, marker_positions_getter, plan_size=plan_size)
         logger.debug('start PlanPageWriterLayerGroupsSimple')
         self.layers_group = layers_group
-        self.caption_placements = {
-            cp.marker.uid: cp.data
-            for cp in layers_group.captionplacement_set.all()   # type: CaptionPlacement
-        }
-        active_layers = Layer.objects.filter(id__in=layers_group.layers)
-        self._active_layers = [l for l in layers if l in active_layers]
+        self.caption_placements = caption_placements
+        self._captions_db_buffer = captions_db_buffer
+        self._active_layers = [l for l in layers if l.id in layers_group.layers]
         logger.debug('start _marker_positions_active')
         self._marker_positions_active = [mo for mo in self._marker_positions
-                                         if mo.layer in self._active_layers]
+                                         if mo.layer_id in layers_group.layers]
         self._marker_positions_active__no_placement = [mo for mo in self._marker_positions_active
                                                        if mo.uid not in self.caption_placements]
         if not self._marker_positions_active:
             # skip layer group where no markers
             raise layout.NoMarkersInActiveGroupException
         self._marker_positions_inactive = [mo for mo in self._marker_positions
-                                           if mo.layer not in self._active_layers]
+                                           if mo.layer_id not in layers_group.layers]
         self._active_db_placed__marker_captions = None
         self._active_not_placed__marker_captions = None
 
         self.max_collisions_allowed = 0
+        self.caption_time_budget = caption_time_budget
+        self.placement_metrics: Optional[PlacementMetrics] = None
         logger.debug('end PlanPageWriterLayerGroupsSimple')
 
     def draw_content(self):
         logger.debug('start draw_content')
-        self._content_box.draw_plan_image(self.canvas, **self.draw_options)
+        self._content_box.draw_plan_image(self.canvas, form_name=self.plan_form_name(), **self.draw_options)
 
         self.draw_options['objects_opacity'] = 40
         self._draw_markers(self._marker_positions_inactive)
@@ -54,11 +68,11 @@ class PlanPageWriterLayerGroupsSimple(PlanPageWriterMinimal):
         self._draw_markers(self._marker_positions_active)
 
         # logger.debug('start place_captions')
-        self._active_db_placed__marker_captions = self.restore_captions_db_data()
+        if self._active_not_placed__marker_captions is None:
+            self.prepare_captions()
         self._draw_marker_captions(self._active_db_placed__marker_captions)
 
         # logger.debug('start _draw_marker_captions')
-        self._active_not_placed__marker_captions = self.place_captions(self._marker_positions_active__no_placement)
         self.store_captions_db_data(self._active_not_placed__marker_captions)
         self._draw_marker_captions(self._active_not_placed__marker_captions)
 
@@ -66,6 +80,34 @@ class PlanPageWriterLayerGroupsSimple(PlanPageWriterMinimal):
         # logger.debug('start _draw_legend')
         self._draw_legend(self._active_layers)
 
+    def prepare_captions(self, new_places: Optional[List[CaptionPlace]] = None):
+        """
+        Расстановка подписей без рисования на canvas (нужны только метрики шрифтов),
+        поэтому может быть выполнена заранее, в том числе в другом процессе
+        :param new_places: placement of captions not stored in db, if already computed elsewhere
+         (see new_caption_places), otherwise they are placed here
+        """
+        self._content_box.fit_to_image()
+        for mo in self._marker_positions:   # type: Object
+            mo.get_bounding_box(self.canvas, self._content_box)     # for attr cache
+        self._active_db_placed__marker_captions = self.restore_captions_db_data()
+        if new_places is None:
+            self._active_not_placed__marker_captions = self.place_captions(self._marker_positions_active__no_placement)
+        else:
+            self._active_not_placed__marker_captions = self.restore_caption_places(new_places)
+
+    @property
+    def new_caption_places(self) -> List[CaptionPlace]:
+        return [(mc.obj.uid, mc.offset, mc.need_rotate) for mc in self._active_not_placed__marker_captions]
+
+    @property
+    def prepared_captions(self) -> Tuple[List[MarkerCaption], List[MarkerCaption]]:
+        return self._active_db_placed__marker_captions, self._active_not_placed__marker_captions
+
+    def use_prepared_captions(self, db_placed: List[MarkerCaption], not_placed: List[MarkerCaption]):
+        self._active_db_placed__marker_captions = db_placed
+        self._active_not_placed__marker_captions = not_placed
+
     def restore_captions_db_data(self) -> List[MarkerCaption]:
         object_index = {mo.uid: mo for mo in self._marker_positions}
         return [
@@ -74,90 +116,47 @@ class PlanPageWriterLayerGroupsSimple(PlanPageWriterMinimal):
             if uid in object_index
         ]
 
+    def restore_caption_places(self, places: List[CaptionPlace]) -> List[MarkerCaption]:
+        object_index = {mo.uid: mo for mo in self._marker_positions_active__no_placement}
+        captions = []
+        for uid, offset, need_rotate in places:
+            caption = object_index[uid].caption()
+            caption.set_box_params(offset=offset, need_rotate=need_rotate)
+            caption.get_bounding_box(self.canvas, force_update=True)
+            captions.append(caption)
+        return captions
+
     def store_captions_db_data(self, captions_to_save: List[MarkerCaption]):
-        list_marker_uid_to_save = [mc.obj.uid for mc in captions_to_save]
-        CaptionPlacement.objects.filter(marker_id__in=list_marker_uid_to_save).delete()
-        CaptionPlacement.objects.bulk_create([
+        placements = [
             CaptionPlacement(
                 marker_id=mc.obj.uid,
                 layer_group=self.layers_group,
                 data=mc.to_db_data(self._content_box),
             )
             for mc in captions_to_save
-        ])
+        ]
+        if self._captions_db_buffer is not None:
+            self._captions_db_buffer.extend(placements)
+            return
+
+        list_marker_uid_to_save = [mc.obj.uid for mc in captions_to_save]
+        CaptionPlacement.objects.filter(marker_id__in=list_marker_uid_to_save).delete()
+        CaptionPlacement.objects.bulk_create(placements)
 
     def place_captions(self, marker_objects: List[Object]) -> List[MarkerCaption]:
         bb_index = BoundsIndex(self.canvas, self._content_box, marker_objects)
-
-        markers_queue = [obj.caption() for obj in marker_objects]
-        for current_marker in markers_queue:
-            self.place_next(bb_index, current_marker)
-
-        captions_right_places = [bb.ref for bb in bb_index.markers_bounds]
-        return captions_right_places
-
-    def place_next(self, bb_index: BoundsIndex, current_marker):
-        # logger.debug(f'place_next at: {current_marker.number}, remains: {len(marker_place_queue)}')
-        place_gen = self.make_marker_placements(bb_index, current_marker)
-        place = next(place_gen)     # take from gen
-        bb_index.write(place)
+        engine = CaptionPlacementEngine(self.canvas, bb_index,
+                                        time_budget=self.caption_time_budget,
+                                        max_collisions_allowed=self.max_collisions_allowed)
+        captions = engine.place(marker_objects)
+        self.placement_metrics = engine.metrics
+        return captions
 
     def _draw_marker_captions(self, captions):
         options = self.draw_options
         for mc in captions:   # type: MarkerCaption
             mc.draw(self.canvas, self._content_box, **options)
 
-    def make_marker_placements(self, bb_index: BoundsIndex, current_marker: MarkerCaption) -> Iterator[BoundingBox]:
-        """
-        Генератор положений подписи (повороты смещения) которые
-        не конфликтуют с другими объектов и маркеров на основании bb_index
-        :raises: MarkerNoPlaceException
-        """
-        place_gen = self._make_marker_placements(current_marker)
-        for place in place_gen:
-            yield place
-
-    def _make_marker_placements(self, current_marker: MarkerCaption) -> Iterator[BoundingBox]:
-        """
-        Генератор положений подписи (повороты смещения) которые
-        не конфликтуют с другими объектов и маркеров на основании bb_index
-        """
-        object_ = current_marker.obj
-        h = MarkerCaption.CAPTION_FONT_SIZE
-        h2 = 2 * h
-        placement_tuning_options = [
-            # (increase_a, cross_delta, comment)
-            (None, None, 'default place'),
-
-            (180, None, 'a + 180 place'),
-            (90,  None, 'a + 90 place'),
-            (270, None, 'a + 270 place'),
-
-            (None, -h,  'default:-h'),
-            (None, -h2, 'default:-2h'),
-            (None, h,   'default:+h'),
-            (None, h2,  'default:+2h'),
-            (180,  -h,  'a + 180:-h'),
-            (180,  -h2, 'a + 180:-2h'),
-            (180,  h,   'a + 180:+h'),
-            (180,  h2,  'a + 180:+2h'),
-            (90,   -h,  'a + 90:-h'),
-            (90,   -h2, 'a + 90:-2h'),
-            (90,   h,   'a + 90:+h'),
-            (90,   h2,  'a + 90:+2h'),
-            (270,  -h,  'a + 270:-h'),
-            (270,  -h2, 'a + 270:-2h'),
-            (270,  h,   'a + 270:+h'),
-            (270,  h2,  'a + 270:+2h'),
-        ]
-
-        for increase_a, cross_delta, comment in placement_tuning_options:
-            offset, need_rotate = object_.get_caption_offset(increase_a=increase_a, cross_delta=cross_delta)
-            current_marker.set_box_params(offset=offset, need_rotate=need_rotate)
-            place = current_marker.get_bounding_box(self.canvas, force_update=True)
-            # logger.info(f'_make_marker_placements: number={current_marker.number}, {comment} -> {place}')
-            yield place
-
     def _draw_box_test_marks(self):
         canvas = self.canvas
         box = self._content_box
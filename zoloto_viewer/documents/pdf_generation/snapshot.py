@@ -0,0 +1,119 @@
+import collections
+import hashlib
+import logging
+
+from typing import Dict, List, Optional, Tuple
+
+from zoloto_viewer.viewer.models import Project, Page, Layer, LayerGroup
+from zoloto_viewer.infoplan.models import CaptionPlacement, Marker, MarkerFingerpost, MarkerVariable
+from zoloto_viewer.infoplan.utils import variable_transformations as transformations
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectSnapshot:
+    """
+    Read-only in-memory copy of project data needed for pdf generation.
+    Loaded with a fixed number of queries, independent of floors and layers count,
+    after that pdf writers don't touch the database (except storing new caption placements).
+    Plan sizes are read here once, so forked layout workers don't download plan images
+    """
+
+    def __init__(self, project: Project, variable_filters: Optional[List[transformations.Transformation]] = None):
+        self.project = project
+        self.floors: List[Page] = list(project.page_set.all())
+        self.layer_groups: List[LayerGroup] = list(LayerGroup.objects.filter(project=project))
+        self._layers: Dict[int, Layer] = {
+            L.id: L
+            for L in Layer.objects.filter(project=project).select_related('color', 'kind').order_by('number', 'id')
+        }
+        floor_captions = {P.uid: P.floor_caption for P in self.floors}
+
+        # (floor uid, layer id) -> {marker uid: position}, ordered as Marker.Meta.ordering
+        self._positions: Dict[Tuple, Dict] = collections.defaultdict(dict)
+        self._numbers: Dict = {}
+        self._floor_layer_ids: Dict = collections.defaultdict(set)
+        marker_rows = Marker.objects \
+            .filter(floor__project=project, layer__isnull=False) \
+            .values_list('uid', 'floor_id', 'layer_id', 'ordinal', 'pos_x', 'pos_y', 'rotation')
+        for uid, floor_uid, layer_id, ordinal, pos_x, pos_y, rotation in marker_rows:
+            self._positions[(floor_uid, layer_id)][uid] = (pos_x, pos_y, rotation)
+            self._numbers[uid] = Marker.format_number(self._layers[layer_id].title, floor_captions[floor_uid], ordinal)
+            self._floor_layer_ids[floor_uid].add(layer_id)
+
+        self._vars_by_side, _ = MarkerVariable.objects.vars_by_side(
+            MarkerVariable.objects.filter(marker__floor__project=project),
+            apply_transformations=variable_filters,
+        )
+        self._fingerposts: Dict = {
+            mf.marker_id: mf.to_json()
+            for mf in MarkerFingerpost.objects.filter(marker__floor__project=project)
+        }
+        self._caption_placements: Dict[int, Dict] = collections.defaultdict(dict)
+        for marker_uid, layer_group_id, data in CaptionPlacement.objects \
+                .filter(layer_group__project=project) \
+                .values_list('marker_id', 'layer_group_id', 'data'):
+            self._caption_placements[layer_group_id][marker_uid] = data
+
+        # ImageField reads the image from storage to get its size
+        self._plan_sizes: Dict = {P.uid: (P.plan.width, P.plan.height) for P in self.floors if P.plan}
+
+        logger.debug(f'ProjectSnapshot loaded: {len(self.floors)} floors, {len(self._numbers)} markers')
+
+    def floor(self, floor_uid) -> Page:
+        return next(P for P in self.floors if P.uid == floor_uid)
+
+    def plan_size(self, floor: Page) -> Optional[Tuple[int, int]]:
+        """(width, height) of the floor plan image, None if the floor has no plan"""
+        return self._plan_sizes.get(floor.uid)
+
+    def floor_layers(self, floor: Page) -> List[Layer]:
+        """Layers having markers on that floor, as Layer.Meta.ordering"""
+        layer_ids = self._floor_layer_ids.get(floor.uid, set())
+        return [L for L in self._layers.values() if L.id in layer_ids]
+
+    def floor_layer_groups(self, floor: Page) -> List[LayerGroup]:
+        """Layer groups having markers on that floor"""
+        layer_ids = self._floor_layer_ids.get(floor.uid, set())
+        return [lg for lg in self.layer_groups if layer_ids.intersection(lg.layers)]
+
+    def marker_positions(self, floor: Page, layer: Layer) -> Dict:
+        return self._positions.get((floor.uid, layer.id), {})
+
+    def marker_number(self, marker_uid) -> str:
+        return self._numbers[marker_uid]
+
+    def marker_vars_by_side(self, marker_uid) -> Dict[int, List[transformations.Variable]]:
+        return self._vars_by_side.get(marker_uid, {})
+
+    def fingerpost_data(self, marker_uid) -> Optional[dict]:
+        return self._fingerposts.get(marker_uid)
+
+    def caption_placements(self, layer_group: LayerGroup) -> Dict:
+        """marker uid -> CaptionPlacement.data"""
+        return self._caption_placements.get(layer_group.id, {})
+
+    def floor_digest(self, floor: Page, *extra) -> str:
+        """
+        Hash of everything floor layout depends on: layers and markers of the floor with their numbers,
+        variables and fingerposts, layer groups membership, marker_size_factor and plan.
+        Caption placements are not hashed, every generation stores them again (and a marker of several
+        layer groups keeps the last one), so layouts are dropped on user edits instead,
+        see placement_redis_cache.drop_floor_layouts
+        """
+        layers = self.floor_layers(floor)
+        marker_uids = [uid for L in layers for uid in self.marker_positions(floor, L)]
+        content = (
+            floor.uid, floor.marker_size_factor, floor.plan.name,
+            [(L.id, L.title, L.color.rgb_code, L.kind.id, L.kind.name, L.kind.sides, L.kind.unicode_symbol)
+             for L in layers],
+            [(lg.id, sorted(lg.layers)) for lg in self.layer_groups],
+            [(L.id, list(self.marker_positions(floor, L).items())) for L in layers],
+            [
+                (uid, self.marker_number(uid), self.fingerpost_data(uid),
+                 [(side, [v.value for v in side_vars]) for side, side_vars in self.marker_vars_by_side(uid).items()])
+                for uid in marker_uids
+            ],
+            extra,
+        )
+        return hashlib.sha1(repr(content).encode()).hexdigest()
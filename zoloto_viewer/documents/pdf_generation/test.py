@@ -1,4 +1,5 @@
 import django
+import functools
 from django.utils import timezone
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
@@ -12,14 +13,14 @@ from . import layout, main, message_page_writer as message, plan_page_writer as
 
 def test_plan():
     C = rc.Canvas(filename, pagesize=layout.Definitions.PAGE_SIZE)
-    writer = plan.PlanPageWriterMinimal(C, P, [L], main.make_marker_objects)
+    writer = plan.PlanPageWriterMinimal(C, P, [L], functools.partial(main.make_marker_objects_many_layers, S))
     writer.write()
     C.save()
 
 
 def test_mess():
     C = rc.Canvas(filename, pagesize=layout.Definitions.PAGE_SIZE)
-    writer = message.MessagePageWriter(C, P, L, main.make_messages_obj)
+    writer = message.MessagePageWriter(C, P, [L], functools.partial(main.make_messages_obj_many_layers, S))
     writer.write()
     C.save()
 
@@ -31,6 +32,7 @@ if __name__ == '__main__':
 
     P = Page.objects.get(uid='2d8bf8ff-9ef2-4a84-b2d5-a6ba60277b30')
     L = P.project.layer_set.filter(title='122_D_HAN').first()
+    S = main.load_snapshot(P.project)
     floor_layer_markers = P.marker_set.filter(layer=L)
 
     title = [P.floor_caption, L.title]
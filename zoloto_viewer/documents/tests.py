@@ -1,3 +1,187 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tarfile
 
-# Create your tests here.
+from unittest import mock
+from django.db.models.fields.files import ImageFieldFile
+from django.test import override_settings
+from django.urls import reverse
+
+from zoloto_viewer.documents.generators.counts import CountFileBuilder
+from zoloto_viewer.documents.models import ProjectFile
+from zoloto_viewer.documents.generators.infoplan import InfoplanFileBuilder
+from zoloto_viewer.documents.pdf_generation import main
+from zoloto_viewer.documents.utils import placement_redis_cache
+from zoloto_viewer.documents.utils.generation_report import GenerationReport
+from zoloto_viewer.helpers.db_stats import capture_query_stats
+from zoloto_viewer.helpers.testing import QueryBudgetTestCase
+from zoloto_viewer.infoplan.models import Marker, MarkerFingerpost
+from zoloto_viewer.viewer.models import LayerGroup, MarkerKind
+
+
+class DocumentsQueryBudgetTest(QueryBudgetTestCase):
+    COUNTS_FILE_BUDGET = 8
+    COUNTS_FILE_CACHED_BUDGET = 7    # session, user, project, file lookup and 3 freshness aggregates
+    PICTS_FILE_BUDGET = 4
+    VARS_FILE_BUDGET = 10
+    PDF_FILE_BUDGET = 9
+    INFOPLAN_LAYER_BUDGET = 2     # per layer, doesn't depend on number of markers
+
+    def test_counts_file(self):
+        self.assertQueryBudget(self.COUNTS_FILE_BUDGET,
+                               lambda: self.client.get(reverse('get_counts_file', args=[self.project.id])))
+        files = list(ProjectFile.objects.values_list('id', 'file'))
+        stored = self.stored_files()
+        # fresh file is not generated again
+        self.assertQueryBudget(self.COUNTS_FILE_CACHED_BUDGET,
+                               lambda: self.client.get(reverse('get_counts_file', args=[self.project.id])))
+        self.assertEqual(list(ProjectFile.objects.values_list('id', 'file')), files)
+        self.assertEqual(self.stored_files(), stored)
+
+    def stored_files(self):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(self._media_root) for name in names)
+
+    def test_picts_file(self):
+        self.assertQueryBudget(self.PICTS_FILE_BUDGET,
+                               lambda: self.client.get(reverse('get_picts_file', args=[self.project.id])))
+
+    def test_vars_file(self):
+        self.assertQueryBudget(self.VARS_FILE_BUDGET,
+                               lambda: self.client.get(reverse('get_vars_file', args=[self.project.id])))
+
+    def test_pdf_file_queued(self):
+        # no fresh pdf, background task is queued
+        self.assertQueryBudget(self.PDF_FILE_BUDGET,
+                               lambda: self.client.get(reverse('get_pdf_file', args=[self.project.id])),
+                               status_code=323)
+
+    def test_infoplan_layer_file(self):
+        # archive endpoint downloads layer files from s3, so layer files are built directly
+        for layer in self.project.layer_set.all():
+            with capture_query_stats() as stats:
+                InfoplanFileBuilder(layer).build()
+            self.assertLessEqual(stats.count, self.INFOPLAN_LAYER_BUDGET, f'query budget exceeded: {stats}')
+
+
+class FloorLayoutCacheTest(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # markers of several layer groups get caption placement of the last drawn group
+        LayerGroup.objects.bulk_create([
+            LayerGroup(project=cls.project, num=100, layers=list(cls.project.layer_set.values_list('id', flat=True)))
+        ])
+
+    def generate(self, cache: dict) -> int:
+        """Generates pdf with dict as floor layout cache, returns number of layouts stored"""
+        def check(floor, digest):
+            return cache.get((floor.uid, digest))
+
+        def store(floor, digest, floor_layout):
+            cache[(floor.uid, digest)] = floor_layout
+
+        with mock.patch.object(placement_redis_cache, 'check_floor_layout', side_effect=check), \
+                mock.patch.object(placement_redis_cache, 'store_floor_layout', side_effect=store) as store_mock:
+            main.generate_pdf(self.project, io.BytesIO(), 'test.pdf', workers=1)
+        return store_mock.call_count
+
+    def test_unchanged_project_hits_cache(self):
+        cache = {}
+        self.assertEqual(self.generate(cache), self.spec.floors)
+        # caption placements stored by the first generation don't change digests
+        self.assertEqual(self.generate(cache), 0)
+
+
+class CountsFileFreshnessTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.marker = Marker.objects.filter(floor__project=self.project, layer__kind__name=MarkerKind.FINGERPOST) \
+            .order_by('ordinal').first()
+
+    def get_counts(self):
+        response = self.client.get(reverse('get_counts_file', args=[self.project.id]))
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return [tuple(row) for row in csv.reader(io.StringIO(content))][1:]
+
+    def assertCountsRegenerated(self, previous):
+        counts = self.get_counts()
+        self.assertNotEqual(counts, previous)
+        self.assertEqual(counts, list(CountFileBuilder(self.project).make_rows()))
+
+    def test_variables_edit(self):
+        counts = self.get_counts()
+        sides = self.marker.layer.kind.sides
+        infoplan = [{'side': n, 'variables': ['x'] * n} for n in range(1, sides + 1)]
+        fingerpost_metadata = {'panes': [{'pane_number': n, 'enabled': True} for n in range(1, sides + 1)]}
+        response = self.client.put(reverse('marker_get_data', args=[self.marker.uid]),
+                                   json.dumps({'infoplan': infoplan, 'fingerpost_metadata': fingerpost_metadata}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertCountsRegenerated(counts)
+
+    def test_fingerpost_panes_edit(self):
+        counts = self.get_counts()
+        mf = MarkerFingerpost.objects.get(marker=self.marker)
+        mf.update_from_obj({'panes': [{'pane_number': n, 'enabled': not mf.is_enabled(n)} for n in range(1, 9)]})
+        self.assertCountsRegenerated(counts)
+
+
+class CaptionTimeBudgetTest(QueryBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        LayerGroup.objects.bulk_create([LayerGroup(project=cls.project, num=100, layers=[])])
+
+    def group_budgets(self):
+        snapshot = main.load_snapshot(self.project)
+        floor = snapshot.floor(self.floor.uid)
+        return [main._make_group_writer(snapshot, floor, lg).caption_time_budget
+                for lg in snapshot.floor_layer_groups(floor)]
+
+    def test_budget_shared_by_groups_with_markers(self):
+        with override_settings(PDF_CAPTION_TIME_BUDGET=12):
+            budgets = self.group_budgets()
+        # group without layers doesn't take a share
+        self.assertEqual(len(budgets), LayerGroup.objects.filter(project=self.project).count() - 1)
+        self.assertAlmostEqual(sum(budgets), 12)
+
+    def test_greedy_only_and_unlimited(self):
+        with override_settings(PDF_CAPTION_TIME_BUDGET=0):
+            self.assertTrue(all(b == 0 for b in self.group_budgets()))
+        with override_settings(PDF_CAPTION_TIME_BUDGET=-1):
+            self.assertTrue(all(b is None for b in self.group_budgets()))
+
+
+class PlanSizesTest(QueryBudgetTestCase):
+    def test_layout_uses_snapshot_plan_sizes(self):
+        snapshot = main.load_snapshot(self.project)
+        for P in snapshot.floors:
+            # as in a worker having no image dimensions read
+            P.plan.__dict__.pop('_dimensions_cache', None)
+        with mock.patch.object(ImageFieldFile, '_get_image_dimensions',
+                               side_effect=AssertionError('plan image is read')):
+            floor_layout = main._compute_floor_layout(snapshot, self.floor.uid)
+        self.assertTrue(floor_layout.groups)
+
+
+class InfoplanArchiveNameTest(QueryBudgetTestCase):
+    def build_archive(self) -> ProjectFile:
+        pf = ProjectFile(project=self.project, kind=ProjectFile.FileKinds.TAR_INFOPLAN)
+        pf._setup_archive_file([(io.BytesIO(b'a,b\r\n'), 'layer.csv')], GenerationReport())
+        return pf
+
+    def assertArchiveFormat(self, pf: ProjectFile, compressed: bool):
+        with pf.file.open('rb') as f, tarfile.open(fileobj=f, mode='r:*') as archive:
+            self.assertEqual(archive.getnames(), ['layer.csv'])
+            f.seek(0)
+            self.assertEqual(f.read(2) == b'\x1f\x8b', compressed)   # gzip magic number
+        self.assertTrue(pf.public_name.endswith('.tar.gz' if compressed else '.tar'))
+
+    def test_name_follows_stored_file_after_setting_toggle(self):
+        for compressed in (True, False):
+            with override_settings(INFOPLAN_ARCHIVE_GZIP=compressed):
+                pf = self.build_archive()
+            with override_settings(INFOPLAN_ARCHIVE_GZIP=not compressed):
+                self.assertArchiveFormat(ProjectFile.objects.get(id=pf.id), compressed)
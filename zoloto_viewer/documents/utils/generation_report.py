@@ -0,0 +1,65 @@
+import contextlib
+import logging
+import time
+
+from django.conf import settings
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationReport:
+    """
+    Длительности этапов построения файла проекта, сохраняется в ProjectFile.generation_report.
+    Повторяющиеся этапы (например, рисование страниц) суммируются, calls - число замеров.
+    Этапы, выполненные в процессах расчёта раскладки, суммируются по всем процессам
+    и могут быть больше общего времени
+    """
+
+    def __init__(self):
+        self._started = time.monotonic()
+        self._total: Optional[float] = None
+        self._stages: Dict[str, Dict] = {}     # name -> {seconds, calls}, in order of first appearance
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def add(self, name, seconds: float):
+        stage = self._stages.setdefault(name, {'seconds': 0., 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+
+    def finish(self):
+        self._total = time.monotonic() - self._started
+
+    @property
+    def total(self) -> float:
+        return self._total if self._total is not None else time.monotonic() - self._started
+
+    def to_json(self) -> dict:
+        return {
+            'total': round(self.total, 3),
+            'stages': [
+                {'name': name, 'seconds': round(stage['seconds'], 3), 'calls': stage['calls']}
+                for name, stage in self._stages.items()
+            ],
+        }
+
+    def __str__(self):
+        stages = ', '.join(
+            f'{name} {stage["seconds"]:.2f}s' + (f' ({stage["calls"]} calls)' if stage['calls'] > 1 else '')
+            for name, stage in self._stages.items()
+        )
+        return f'total {self.total:.2f}s: {stages}'
+
+    def log(self, title):
+        """Info line with all stages, warning if generation takes considerable part of background task time"""
+        if self.total > settings.GENERATION_REPORT_WARN_TIME:
+            logger.warning(f'{title} slow generation ({settings.MAX_RUN_TIME}s per task allowed), {self}')
+        else:
+            logger.info(f'{title} {self}')
@@ -1,3 +1,4 @@
+import logging
 import pickle
 import redis
 
@@ -5,6 +6,8 @@ from django.conf import settings
 from datetime import datetime, timezone
 from typing import Any, List, Optional, Tuple
 
+logger = logging.getLogger(__name__)
+
 redis_cache = redis.Redis.from_url(settings.REDIS_URL)
 
 
@@ -45,3 +48,51 @@ def is_cache_fresh(floor: 'Page', layers: List['Layers'], timestamp: datetime) -
         return max_date_updated < timestamp
     except TypeError:
         return False
+
+
+def make_floor_layout_key(floor: 'Page', digest: str):
+    return f'floor_layout__floor_{floor.uid}_{digest}'
+
+
+def check_floor_layout(floor: 'Page', digest: str) -> Optional[Any]:
+    """Cached layout of the floor if it was stored for the same content digest"""
+    if not settings.PDF_LAYOUT_CACHE_TTL:
+        return
+    try:
+        val_ = redis_cache.get(make_floor_layout_key(floor, digest))
+    except redis.RedisError as e:
+        logger.warning(f'floor layout cache unavailable: {e}')
+        return
+    if val_ is None:
+        return
+
+    try:
+        floor_layout, timestamp = pickle.loads(val_)
+    except Exception as e:
+        # stored by another version of the code, will be replaced by store_floor_layout
+        logger.warning(f'floor layout cache entry is not readable: {e!r}')
+        return
+    return floor_layout
+
+
+def store_floor_layout(floor: 'Page', digest: str, floor_layout):
+    # previous digests of the floor are not deleted, they expire
+    if not settings.PDF_LAYOUT_CACHE_TTL:
+        return
+    obj = (floor_layout, datetime.now(tz=timezone.utc))
+    val_ = pickle.dumps(obj)
+    key_ = make_floor_layout_key(floor, digest)
+    try:
+        redis_cache.set(key_, val_, ex=settings.PDF_LAYOUT_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning(f'floor layout cache unavailable: {e}')
+
+
+def drop_floor_layouts(floor: 'Page'):
+    """Layouts of the floor for all digests, called when captions of its markers are edited"""
+    try:
+        keys = list(redis_cache.scan_iter(match=make_floor_layout_key(floor, '*')))
+        if keys:
+            redis_cache.delete(*keys)
+    except redis.RedisError as e:
+        logger.warning(f'floor layout cache unavailable: {e}')
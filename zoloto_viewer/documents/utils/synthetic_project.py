@@ -0,0 +1,124 @@
+import io
+import random
+
+from PIL import Image, ImageDraw
+from dataclasses import dataclass
+from django.core.files.base import ContentFile
+from django.db import transaction
+from typing import List
+
+from zoloto_viewer.viewer.models import Color, Layer, LayerGroup, MarkerKind, Page, Project
+from zoloto_viewer.infoplan.models import Marker, MarkerFingerpost, MarkerVariable
+from zoloto_viewer.infoplan.utils.variable_transformations import ReplacePictCodes
+
+WORDS_RU = ['Выход', 'Лифт', 'Касса', 'Зал', 'Гардероб', 'Кафе', 'Туалет', 'Лестница', 'Парковка', 'Вход']
+WORDS_EN = ['Exit', 'Lift', 'Cashier', 'Hall', 'Cloakroom', 'Cafe', 'Toilet', 'Stairs', 'Parking', 'Entrance']
+
+
+@dataclass
+class SyntheticProjectSpec:
+    """Размеры синтетического проекта, одинаковые spec и seed дают одинаковые данные"""
+    floors: int = 5
+    layers_per_kind: int = 2            # for every MarkerKind, fingerposts included
+    markers_per_floor: int = 200
+    variables_per_side: int = 3
+    pict_codes_per_variable: int = 1
+    layers_per_group: int = 5
+    plan_width: int = 4000
+    plan_height: int = 2500
+    seed: int = 0
+
+    def default_title(self):
+        return f'synthetic_{self.floors}x{self.markers_per_floor}_seed{self.seed}'
+
+
+def create_synthetic_project(spec: SyntheticProjectSpec, title=None) -> Project:
+    """
+    Creates project with floors, layers of every marker kind, layer groups, markers, variables and fingerpost panes.
+    Markers and variables are created in bulk, so Marker.save side effects are reproduced here
+    """
+    rng = random.Random(spec.seed)
+    kinds = list(MarkerKind.objects.all())
+    colors = list(Color.objects.all())
+
+    with transaction.atomic():
+        project = Project.objects.create(title=title or spec.default_title(), customer='synthetic', stage='benchmark')
+
+        layers = []
+        for kind in kinds:
+            for _ in range(spec.layers_per_kind):
+                number = len(layers) + 1
+                layers.append(Layer(project=project, title=f'{number}_SYN', number=number,
+                                    desc=f'{kind.name} {number}', kind=kind,
+                                    color=colors[number % len(colors)]))
+        layers = Layer.objects.bulk_create(layers)
+
+        # LayerGroup.save also drops redis caches of the group, not needed for a new project
+        LayerGroup.objects.bulk_create(
+            LayerGroup(project=project, num=num, layers=[L.id for L in layers[i:i + spec.layers_per_group]])
+            for num, i in enumerate(range(0, len(layers), spec.layers_per_group), start=1)
+        )
+
+        floors = [
+            Page.create_or_replace(project=project, plan=make_plan_image(spec, n, rng),
+                                   indd_floor=f'floor_{n}', floor_caption=f'{n}F')
+            for n in range(1, spec.floors + 1)
+        ]
+
+        markers = []
+        for floor in floors:
+            ordinals = {L.id: 0 for L in layers}
+            for _ in range(spec.markers_per_floor):
+                layer = rng.choice(layers)
+                ordinals[layer.id] += 1
+                markers.append(Marker(floor=floor, layer=layer, ordinal=ordinals[layer.id],
+                                      pos_x=rng.randrange(spec.plan_width), pos_y=rng.randrange(spec.plan_height),
+                                      rotation=rng.choice([0, 90, 180, 270, rng.randrange(360)])))
+        markers = Marker.objects.bulk_create(markers, batch_size=1000)
+
+        MarkerFingerpost.objects.bulk_create((
+            MarkerFingerpost(marker=m, **{f'side{i}_enabled': rng.random() < 0.5 for i in range(1, 9)})
+            for m in markers if m.layer.kind.is_fingerpost
+        ), batch_size=1000)
+
+        MarkerVariable.objects.bulk_create((
+            MarkerVariable(marker=m, side=side, key=key, value=make_variable_value(spec, rng))
+            for m in markers
+            for side in m.layer.kind.side_keys()
+            for key in range(1, spec.variables_per_side + 1)
+        ), batch_size=5000)
+
+    return project
+
+
+def make_plan_image(spec: SyntheticProjectSpec, floor_number, rng: random.Random) -> ContentFile:
+    """Plan-like picture: walls grid with random rooms and corridors"""
+    image = Image.new('RGB', (spec.plan_width, spec.plan_height), 'white')
+    draw = ImageDraw.Draw(image)
+    line_width = max(2, spec.plan_width // 500)
+    for _ in range(40):
+        x, y = rng.randrange(spec.plan_width), rng.randrange(spec.plan_height)
+        w, h = rng.randint(spec.plan_width // 25, spec.plan_width // 3), \
+            rng.randint(spec.plan_height // 25, spec.plan_height // 3)
+        draw.rectangle([x, y, x + w, y + h], outline='black', width=line_width,
+                       fill=rng.choice(['white', '#f0f0f0', '#e0e8f0']))
+    for _ in range(10):
+        y = rng.randrange(spec.plan_height)
+        draw.line([0, y, spec.plan_width, y], fill='#999999', width=line_width)
+    draw.rectangle([0, 0, spec.plan_width - 1, spec.plan_height - 1], outline='black', width=3 * line_width)
+
+    buf = io.BytesIO()
+    image.save(buf, 'PNG')
+    return ContentFile(buf.getvalue(), name=f'floor_{floor_number}.png')
+
+
+def make_variable_value(spec: SyntheticProjectSpec, rng: random.Random) -> str:
+    """Pairs of russian and english lines, like real infoplan variables, with pict codes in the first line"""
+    lines: List[str] = []
+    for _ in range(rng.randint(1, 2)):
+        n = rng.randrange(len(WORDS_RU))
+        lines.extend([WORDS_RU[n], WORDS_EN[n]])
+    picts = [rng.choice(ReplacePictCodes.REPLACE_TABLE)[0] for _ in range(spec.pict_codes_per_variable)]
+    if picts:
+        lines[0] = ' '.join(picts + [lines[0]])
+    return '\n'.join(lines)
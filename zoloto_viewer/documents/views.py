@@ -20,7 +20,9 @@ from zoloto_viewer.documents.models import ProjectFile
 @http.require_GET
 def get_counts_file(request, project_id):
     project = get_object_or_404(Project, id=project_id)
-    pf = ProjectFile.objects.generate_counts(project)
+    pf = ProjectFile.objects.look_for_fresh(project, ProjectFile.FileKinds.CSV_LAYER_STATS)
+    if not pf:
+        pf = ProjectFile.objects.generate_counts(project)
     return FileResponse(pf.file, filename=pf.public_name)
 
 
@@ -29,8 +31,10 @@ def get_counts_file(request, project_id):
 @http.require_GET
 def get_picts_file(request, project_id):
     project = get_object_or_404(Project, id=project_id)
-    pf = ProjectFile.objects.generate_pict_list(project)
-    return FileResponse(pf.file, filename=pf.public_name)
+    # list is built on every request anyway, so csv is streamed to the response without storing a file
+    kind = ProjectFile.FileKinds.CSV_PICT_CODES
+    builder = ProjectFile.FILE_BUILDERS[kind](project)
+    return FileResponse(builder.open_stream(), filename=ProjectFile.make_name(kind, project=project))
 
 
 @login_required
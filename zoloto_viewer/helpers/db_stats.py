@@ -0,0 +1,60 @@
+import contextlib
+import logging
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Число sql запросов и суммарное время их выполнения, собирается через connection.execute_wrapper"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.monotonic() - started
+
+    def __str__(self):
+        return f'{self.count} queries, {self.time * 1000:.1f}ms'
+
+
+@contextlib.contextmanager
+def capture_query_stats(using=DEFAULT_DB_ALIAS):
+    """Unlike CaptureQueriesContext works with DEBUG = False and doesn't keep queries text"""
+    stats = QueryStats()
+    with connections[using].execute_wrapper(stats):
+        yield stats
+
+
+class QueryStatsMiddleware:
+    """
+    Adds X-DB-Queries and X-DB-Time-Ms headers to every response and logs them,
+    requests making more than settings.REQUEST_QUERIES_WARN_COUNT queries are logged with a warning.
+    Queries made while streaming response content are not counted
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture_query_stats() as stats:
+            response = self.get_response(request)
+
+        response['X-DB-Queries'] = str(stats.count)
+        response['X-DB-Time-Ms'] = f'{stats.time * 1000:.1f}'
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        message = f'{request.method} {request.path} ({view_name}): {stats}'
+        if stats.count > settings.REQUEST_QUERIES_WARN_COUNT:
+            logger.warning(message)
+        else:
+            logger.debug(message)
+        return response
@@ -0,0 +1,53 @@
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from zoloto_viewer.documents.utils.synthetic_project import SyntheticProjectSpec, create_synthetic_project
+from zoloto_viewer.helpers.db_stats import capture_query_stats
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Synthetic project with logged in client, files are stored in temporary MEDIA_ROOT.
+    Budgets are measured on this spec, update them together with the spec
+    """
+    spec = SyntheticProjectSpec(floors=2, layers_per_kind=1, markers_per_floor=20, variables_per_side=2,
+                                plan_width=400, plan_height=250)
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp()
+        cls._storage_settings = override_settings(
+            DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            MEDIA_ROOT=cls._media_root,
+        )
+        cls._storage_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._storage_settings.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='test')
+        cls.project = create_synthetic_project(cls.spec, title='test')
+        cls.floor = cls.project.page_set.order_by('indd_floor').first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertQueryBudget(self, budget, request, status_code=200):
+        """Makes request and checks number of queries, DB time is shown in failure message only"""
+        with capture_query_stats() as stats:
+            response = request()
+            if response.streaming:
+                # streamed csv makes queries while content is read, test client closes file responses then
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status_code)
+        self.assertLessEqual(stats.count, budget, f'query budget exceeded: {stats}')
+        return stats
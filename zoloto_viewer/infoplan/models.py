@@ -5,7 +5,8 @@ import uuid
 import re
 
 from django.contrib.postgres import fields
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.utils import timezone
 
 from zoloto_viewer.viewer.models import LayerGroup
 from zoloto_viewer.infoplan.utils import variable_transformations
@@ -39,6 +40,16 @@ class MarkersManager(models.Manager):
         lm = q.aggregate(value=models.Max('last_modified'))['value']
         return lm
 
+    def bulk_serialize(self, marker_uid_list, transformations=None) -> t.List[dict]:
+        """Same as Marker.serialize for every marker, number of queries doesn't depend on markers count"""
+        markers = list(
+            self.filter(uid__in=marker_uid_list)
+                .select_related('floor', 'layer__color', 'layer__kind')
+                .prefetch_related('markercomment_set', 'markerfingerpost_set')
+        )
+        infoplan = MarkerVariable.objects.vars_of_markers_by_side(markers, apply_transformations=transformations)
+        return [m.serialize(transformations, infoplan=infoplan[m.uid]) for m in markers]
+
     def get_numbers(self, floor, layer):
         return {m.uid: m.number
                 for m in self.filter(floor=floor, layer=layer).prefetch_related('floor', 'layer').all()}
@@ -97,7 +108,11 @@ class Marker(models.Model):
 
     @property
     def number(self):
-        return f'{self.layer.title}  {self.floor.floor_caption}  {self.ordinal}'
+        return self.format_number(self.layer.title, self.floor.floor_caption, self.ordinal)
+
+    @staticmethod
+    def format_number(layer_title, floor_caption, ordinal):
+        return f'{layer_title}  {floor_caption}  {ordinal}'
 
     @property
     def neg_rotation(self):
@@ -159,18 +174,22 @@ class Marker(models.Model):
             MarkerVariable.objects.bulk_create(variables)
         return mc
 
-    def serialize(self, transformations=None):
+    def serialize(self, transformations=None, infoplan=None):
+        """:param infoplan: variables of the marker if already loaded, see MarkersManager.bulk_serialize"""
         if not transformations:
             transformations = []
+        if infoplan is None:
+            infoplan = MarkerVariable.objects.vars_of_marker_by_side(self, apply_transformations=transformations)
         rep = self.to_json()
 
         rep.update({
             'comments': self.comments_json,
-            'infoplan': MarkerVariable.objects.vars_of_marker_by_side(self, apply_transformations=transformations),
+            'infoplan': infoplan,
         })
         if self.layer.kind.is_fingerpost:
+            # all() instead of first() to use prefetched fingerpost
             rep.update({
-                'fingerpost_data': self.markerfingerpost_set.first().to_json()
+                'fingerpost_data': self.markerfingerpost_set.all()[0].to_json()
             })
 
         rep.update({
@@ -288,6 +307,7 @@ class MarkerFingerpost(models.Model):
                 enabled = bool(pane_obj['enabled'])
                 setattr(self, f'side{number}_enabled', enabled)
         self.save()
+        self.marker.save()  # to update marker.last_modified
 
 
 class CaptionPlacement(models.Model):
@@ -439,6 +459,19 @@ class VariablesManager(models.Manager):
             ])
             marker.save()   # to update marker.last_modified
 
+    def reset_markers_side_values(self, marker_uid_list, vars_by_side):
+        """reset_side_values of every side for all markers at once"""
+        with transaction.atomic():
+            self.filter(marker_id__in=marker_uid_list, side__in=vars_by_side.keys()).delete()
+            self.bulk_create([
+                MarkerVariable(marker_id=marker_uid, side=n_side, key=k, value=v)
+                for marker_uid in marker_uid_list
+                for n_side, values in vars_by_side.items()
+                for k, v in enumerate(values)
+            ])
+            # marker.save() is not called for every marker, auto_now is not applied by update
+            Marker.objects.filter(uid__in=marker_uid_list).update(last_modified=timezone.now())
+
     def vars_by_side(self, queryset: models.QuerySet, apply_transformations=None):
         from zoloto_viewer.infoplan.utils.variable_transformations import Variable
         markers = set()
@@ -468,17 +501,22 @@ class VariablesManager(models.Manager):
         #   {marker: UUID(), side: 1, variables: ['a', 'b']},
         #   {marker: UUID(), side: 2, variables: []}
         # ]
-        variables = self.filter(marker=marker)
-        vars_by_side, markers = self.vars_by_side(variables, apply_transformations)
-        res = [
-            {
-                'side': side_key,
-                'variables': [v.value for v in vars_by_side[marker_uid].get(side_key, [])],
-            }
-            for marker_uid in markers
-            for side_key in marker.layer.kind.side_keys()
-        ]
-        return res
+        return self.vars_of_markers_by_side([marker], apply_transformations)[marker.uid]
+
+    def vars_of_markers_by_side(self, markers: t.List[Marker], apply_transformations=None) -> t.Dict[uuid.UUID, list]:
+        """marker uid -> vars_of_marker_by_side, with one query"""
+        variables = self.filter(marker__in=markers)
+        vars_by_side, with_vars = self.vars_by_side(variables, apply_transformations)
+        return {
+            marker.uid: [
+                {
+                    'side': side_key,
+                    'variables': [v.value for v in vars_by_side[marker.uid].get(side_key, [])],
+                }
+                for side_key in marker.layer.kind.side_keys()
+            ] if marker.uid in with_vars else []
+            for marker in markers
+        }
 
     def vars_page_layer_by_side(self, page, layer, apply_transformations=None):
         variables = self.filter(marker__floor=page, marker__layer=layer)
@@ -492,6 +530,18 @@ class VariablesManager(models.Manager):
             .filter(value__regex=lang_ru).filter(value__regex=lang_en)
         return containing.values_list('id', flat=True)
 
+    def pict_codes_usage(self, project) -> t.List[t.Tuple[str, int]]:
+        """Pict codes of project variables with number of uses, ordered by code, extracted by postgres"""
+        variables = self.filter(marker__floor__project=project, value__contains='@').order_by().values('value')
+        variables_sql, params = variables.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT code[1], count(*) FROM ({variables_sql}) AS v, regexp_matches(v.value, %s, 'g') AS code "
+                f"GROUP BY code[1] ORDER BY code[1]",
+                (*params, self.model.PICT_PATTERN)
+            )
+            return cursor.fetchall()
+
     def var_replace_helper(self, project, name_old, name_new, filter_ids_in=None):
         if not name_old and not name_new:
             return []
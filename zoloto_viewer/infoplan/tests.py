@@ -1,3 +1,51 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from django.urls import reverse
+
+from zoloto_viewer.helpers.testing import QueryBudgetTestCase
+from zoloto_viewer.infoplan.models import CaptionPlacement, Marker, MarkerVariable
+from zoloto_viewer.viewer.models import LayerGroup
+
+
+class InfoplanQueryBudgetTest(QueryBudgetTestCase):
+    # budgets of bulk apis don't depend on number of markers in request
+    FETCH_BULK_BUDGET = 6
+    SUBMIT_BULK_BUDGET = 12
+    FLOOR_CAPTIONS_BUDGET = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        group = LayerGroup.objects.filter(project=cls.project).first()
+        CaptionPlacement.objects.bulk_create(
+            CaptionPlacement.make_default(m, group)
+            for m in Marker.objects.filter(floor=cls.floor).select_related('layer__kind')
+        )
+
+    def floor_markers(self):
+        return list(Marker.objects.filter(floor=self.floor).select_related('layer__kind')
+                    .order_by('layer__number', 'ordinal'))
+
+    def test_fetch_markers_bulk(self):
+        markers = self.floor_markers()
+        for n in (1, len(markers)):
+            request = {'markers': [str(m.uid) for m in markers[:n]]}
+            self.assertQueryBudget(self.FETCH_BULK_BUDGET, lambda: self.client.post(
+                reverse('fetch_markers_bulk'), json.dumps(request), content_type='application/json'
+            ))
+
+    def test_submit_markers_bulk(self):
+        # fingerposts have the most sides
+        markers = [m for m in self.floor_markers() if m.layer.kind.is_fingerpost]
+        for n in (1, len(markers)):
+            request = {
+                'markers': [str(m.uid) for m in markers[:n]],
+                'infoplan': MarkerVariable.objects.vars_of_marker_by_side(markers[0]),
+            }
+            self.assertQueryBudget(self.SUBMIT_BULK_BUDGET, lambda: self.client.post(
+                reverse('submit_markers_bulk'), json.dumps(request), content_type='application/json'
+            ))
+
+    def test_load_floor_captions(self):
+        self.assertQueryBudget(self.FLOOR_CAPTIONS_BUDGET,
+                               lambda: self.client.get(reverse('load_floor_captions'), {'floor': self.floor.code}))
@@ -11,6 +11,7 @@ from django.views import View
 from django.views.decorators import csrf, http
 from django.utils.decorators import method_decorator
 
+from zoloto_viewer.documents.utils import placement_redis_cache
 from zoloto_viewer.infoplan.models import Marker, MarkerComment, MarkerFingerpost, MarkerVariable, CaptionPlacement
 from zoloto_viewer.infoplan.utils import variable_transformations as transformations
 from zoloto_viewer.viewer.models import Layer, Page, Project, LayerGroup
@@ -109,10 +110,7 @@ def fetch_markers_bulk(request):
 
     filters = []
     rep = {
-        'markers': [
-            m.serialize(filters)
-            for m in Marker.objects.filter(uid__in=marker_uid_list)
-        ],
+        'markers': Marker.objects.bulk_serialize(marker_uid_list, filters),
     }
     return JsonResponse(rep)
 
@@ -139,16 +137,12 @@ def submit_markers_bulk(request):
     if not isinstance(markers, list):
         markers = markers.split(',')
 
-    for m in Marker.objects.filter(uid__in=markers):
-        for side, variables in vars_by_side.items():
-            MarkerVariable.objects.reset_side_values(m, n_side=side, values=variables)
+    marker_uid_list = list(Marker.objects.filter(uid__in=markers).values_list('uid', flat=True))
+    MarkerVariable.objects.reset_markers_side_values(marker_uid_list, vars_by_side)
 
     filters = []
     rep = {
-        'markers': [
-            m.serialize(filters)
-            for m in Marker.objects.filter(uid__in=markers)
-        ],
+        'markers': Marker.objects.bulk_serialize(marker_uid_list, filters),
     }
     return JsonResponse(rep)
 
@@ -373,6 +367,7 @@ class MarkerCaptionView(View):
             layergroup = LayerGroup.find_by_layer(marker.layer_id)
             caption_placement = CaptionPlacement.make_default(marker, layergroup)
             caption_placement.save()
+            placement_redis_cache.drop_floor_layouts(marker.floor)
 
         rep = marker.to_json()
         rep.update({
@@ -399,6 +394,7 @@ class MarkerCaptionView(View):
             layergroup = LayerGroup.find_by_layer(marker.layer_id)
             caption_placement = CaptionPlacement.make_default(marker, layergroup)
             caption_placement.save()
+            placement_redis_cache.drop_floor_layouts(marker.floor)
 
         try:
             req = json.loads(request.body)
@@ -418,6 +414,8 @@ class MarkerCaptionView(View):
         if rotation is not None:
             caption_placement.data.update({'rotation': rotation})
         caption_placement.save()
+        # cached pdf layouts of the floor don't include edited caption
+        placement_redis_cache.drop_floor_layouts(marker.floor)
 
         rep = caption_placement.to_json()
         return JsonResponse(rep)
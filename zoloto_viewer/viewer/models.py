@@ -37,10 +37,11 @@ class Project(models.Model):
 
     @property
     def date_updated_include_layers_pages(self):
+        # Max is None without layers or pages
         last_updated_layers = self.layer_set.aggregate(value=models.Max('date_updated'))['value'] \
-            if self.layer_set.exists() else self.date_updated
+            or self.date_updated
         last_updated_pages = self.page_set.aggregate(value=models.Max('date_updated'))['value'] \
-            if self.page_set.exists() else self.date_updated
+            or self.date_updated
         return max([self.date_updated, last_updated_layers, last_updated_pages])
 
     @property
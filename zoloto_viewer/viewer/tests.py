@@ -1,11 +1,13 @@
 import pytest
-from django.test import TestCase
+from django.test import TestCase, modify_settings
+from django.urls import reverse
 
 # Create your tests here.
 from zoloto_viewer.viewer.models import (
     Page,
     Project,
 )
+from zoloto_viewer.helpers.testing import QueryBudgetTestCase
 
 
 @pytest.fixture
@@ -19,3 +21,22 @@ def test_page_create_or_replace(big_jpg_file):
     project = Project()
     page = Page.create_or_replace(project, big_jpg_file, '', '')
 
+
+class ViewerQueryBudgetTest(QueryBudgetTestCase):
+    PROJECT_PAGE_BUDGET = 19
+    LAYER_GROUPS_BUDGET = 10
+
+    def test_project_page(self):
+        for floor in self.project.page_set.all():
+            self.assertQueryBudget(self.PROJECT_PAGE_BUDGET,
+                                   lambda: self.client.get(reverse('project_page', args=[floor.code])))
+
+    def test_layer_groups_view(self):
+        self.assertQueryBudget(self.LAYER_GROUPS_BUDGET,
+                               lambda: self.client.get(reverse('setup_layer_groups', args=[self.project.id])))
+
+    @modify_settings(MIDDLEWARE={'append': 'zoloto_viewer.helpers.db_stats.QueryStatsMiddleware'})
+    def test_query_stats_headers(self):
+        response = self.client.get(reverse('setup_layer_groups', args=[self.project.id]))
+        self.assertLessEqual(int(response['X-DB-Queries']), self.LAYER_GROUPS_BUDGET)
+        self.assertGreater(float(response['X-DB-Time-Ms']), 0)